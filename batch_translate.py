@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行批量翻譯工具
+流式讀取TXT/TSV/CSV/JSONL文件，按塊翻譯並即時寫入結果，使用翻譯記憶庫，
+中斷後可從檢查點繼續（無需QApplication，適合在服務器上處理大型語料）
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+# 添加當前目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from translator import BatchTranslationEngine, ProviderMetrics, TranslationMemory
+
+FORMATS = ('txt', 'tsv', 'csv', 'jsonl')
+
+
+def detect_format(path):
+    """按擴展名判斷文件格式"""
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return ext if ext in FORMATS else 'txt'
+
+
+def load_config(path):
+    """載入配置文件"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARNING] 配置文件載入失敗: {e}，使用默認設定")
+        return {}
+
+
+class RecordReader:
+    """逐條讀取輸入記錄，返回 (記錄, 待翻譯文本)"""
+
+    def __init__(self, path, fmt, column=0, field='text', header=False):
+        self.path = path
+        self.fmt = fmt
+        self.column = column
+        self.field = field
+        self.header = header
+        self.header_row = None
+
+    def __iter__(self):
+        with open(self.path, 'r', encoding='utf-8', newline='' if self.fmt in ('tsv', 'csv') else None) as f:
+            if self.fmt == 'txt':
+                for line in f:
+                    line = line.rstrip('\r\n')
+                    yield line, line
+            elif self.fmt == 'jsonl':
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    yield record, str(record.get(self.field, ''))
+            else:
+                reader = csv.reader(f, delimiter='\t' if self.fmt == 'tsv' else ',')
+                if self.header:
+                    self.header_row = next(reader, None)
+                for row in reader:
+                    yield row, row[self.column] if len(row) > self.column else ''
+
+
+class RecordWriter:
+    """把翻譯結果按輸入格式寫入輸出文件"""
+
+    def __init__(self, f, fmt, output_field='translation'):
+        self.f = f
+        self.fmt = fmt
+        self.output_field = output_field
+
+    def write_header(self, header_row):
+        self._write_row(header_row + [self.output_field])
+
+    def write(self, record, translation):
+        if self.fmt == 'txt':
+            self.f.write(translation.replace('\n', ' ') + '\n')
+        elif self.fmt == 'jsonl':
+            record = dict(record)
+            record[self.output_field] = translation
+            self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            self._write_row(record + [translation])
+
+    def _write_row(self, row):
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter='\t' if self.fmt == 'tsv' else ',', lineterminator='\n').writerow(row)
+        self.f.write(buffer.getvalue())
+
+
+class Checkpoint:
+    """檢查點：記錄已完成的輸入記錄數及對應的輸出文件大小"""
+
+    def __init__(self, path, input_path):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.input_size = os.path.getsize(input_path)
+        self.records = 0
+        self.output_size = 0
+
+    def load(self):
+        """載入與當前輸入文件匹配的檢查點，返回是否成功"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] 檢查點無法讀取: {e}")
+            return False
+        if data.get('input') != self.input_path or data.get('input_size') != self.input_size:
+            print("[WARNING] 檢查點與輸入文件不匹配，重新開始")
+            return False
+        self.records = data['records']
+        self.output_size = data['output_size']
+        return True
+
+    def save(self, records, output_size):
+        """原子地更新檢查點"""
+        self.records = records
+        self.output_size = output_size
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'input': self.input_path,
+                'input_size': self.input_size,
+                'records': records,
+                'output_size': output_size,
+                'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def chunked(iterable, size):
+    """按固定大小分塊"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def translate_file(args, config):
+    """翻譯整個文件，返回是否全部完成"""
+    fmt = args.format or detect_format(args.input)
+    output = args.output or f"{os.path.splitext(args.input)[0]}.{args.target}.{fmt}"
+    checkpoint = Checkpoint(args.checkpoint or output + '.checkpoint', args.input)
+    resumed = not args.restart and checkpoint.load() and os.path.exists(output)
+
+    reader = RecordReader(args.input, fmt, args.column, args.field, args.header)
+    records = iter(reader)
+
+    if resumed:
+        # 丟棄最後一個檢查點之後寫入的不完整數據
+        os.truncate(output, checkpoint.output_size)
+        out = open(output, 'a', encoding='utf-8', newline='')
+        records = islice(records, checkpoint.records, None)
+        print(f"[INFO] 從檢查點繼續: 已完成 {checkpoint.records} 條記錄")
+    else:
+        out = open(output, 'w', encoding='utf-8', newline='')
+        checkpoint.records = 0
+
+    memory = TranslationMemory.from_config(config, args.db)
+    metrics = ProviderMetrics.configure(config)
+    engine = BatchTranslationEngine(config, memory, args.source, args.target, use_fuzzy=args.fuzzy)
+    writer = RecordWriter(out, fmt, args.output_field)
+    stats = {'cache': 0, 'fuzzy': 0, 'api': 0}
+    done = start_done = checkpoint.records
+    header_pending = not resumed
+    start = time.perf_counter()
+
+    try:
+        for chunk in chunked(records, args.chunk_size):
+            if header_pending and reader.header_row is not None:
+                writer.write_header(reader.header_row)
+            header_pending = False
+
+            # 空白記錄不翻譯，原樣輸出空譯文
+            indexes = [i for i, (_, text) in enumerate(chunk) if text.strip()]
+            results = {}
+            engine.translate([chunk[i][1] for i in indexes], results.update)
+
+            for position, i in enumerate(indexes):
+                stats[results[position]['source']] += 1
+            translations = {i: results[position]['translation'] for position, i in enumerate(indexes)}
+            for i, (record, _) in enumerate(chunk):
+                writer.write(record, translations.get(i, ''))
+
+            out.flush()
+            os.fsync(out.fileno())
+            done += len(chunk)
+            checkpoint.save(done, os.path.getsize(output))
+
+            elapsed = time.perf_counter() - start
+            print(f"[INFO] 已完成 {done} 條記錄（緩存 {stats['cache']}，近似 {stats['fuzzy']}，"
+                  f"API {stats['api']}），{(done - start_done) / max(elapsed, 1e-9):,.0f} 條/秒")
+    except KeyboardInterrupt:
+        print(f"\n[INFO] 已中斷，完成 {done} 條記錄。重新執行相同命令即可從檢查點繼續")
+        return False
+    finally:
+        out.close()
+        memory.close()
+        metrics.close()
+
+    checkpoint.remove()
+    print(f"[INFO] 翻譯完成: {done} 條記錄 -> {output}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令行批量翻譯（TXT/TSV/CSV/JSONL）")
+    parser.add_argument('input', help="輸入文件")
+    parser.add_argument('-o', '--output', help="輸出文件（默認為 輸入文件名.目標語言.擴展名）")
+    parser.add_argument('-f', '--format', choices=FORMATS, help="文件格式（默認按擴展名判斷）")
+    parser.add_argument('-s', '--source', help="源語言（默認取自配置）")
+    parser.add_argument('-t', '--target', help="目標語言（默認取自配置）")
+    parser.add_argument('--column', type=int, default=0, help="TSV/CSV中待翻譯的列（從0開始）")
+    parser.add_argument('--header', action='store_true', help="TSV/CSV第一行為表頭")
+    parser.add_argument('--field', default='text', help="JSONL中待翻譯的字段")
+    parser.add_argument('--output-field', default='translation', help="輸出的譯文字段/列名")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="使用近似匹配的譯文（默認只用精確匹配或API，輸出中不區分近似譯文）")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="每次翻譯並寫入檢查點的記錄數")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'),
+                        help="配置文件")
+    parser.add_argument('--db', default='translation_memory.db', help="翻譯記憶庫")
+    parser.add_argument('--checkpoint', help="檢查點文件（默認為 輸出文件.checkpoint）")
+    parser.add_argument('--restart', action='store_true', help="忽略檢查點，重新開始")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    translation_config = config.get('translation', {})
+    args.source = args.source or translation_config.get('default_source', 'auto')
+    args.target = args.target or translation_config.get('default_target', 'zh-TW')
+
+    sys.exit(0 if translate_file(args, config) else 130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+翻譯記憶庫性能基準測試
+比較舊版（每次查詢新建連接）、連接池及記憶體前置緩存的查詢吞吐量，
+以及逐條提交與延遲批量寫入的保存吞吐量、大型記憶庫上的歷史查詢、搜索及近似匹配延遲，
+以及鍵規範化前後模擬剪貼板流量的命中率
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import unicodedata
+
+# 添加當前目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from translator import TranslationMemory
+
+
+def populate(memory, rows):
+    """寫入測試數據"""
+    for i in range(rows):
+        memory.save_translation(f"Benchmark sentence {i}", f"基準測試句子 {i}", "en", "zh-TW", "bench")
+
+
+def remove_database(db_path):
+    """刪除測試資料庫及WAL文件"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def legacy_get_translation(db_path, source_text, source_lang, target_lang):
+    """舊版查詢方式：每次查詢都新建並關閉連接"""
+    text_hash = hashlib.md5(f"{source_text}{source_lang}{target_lang}".encode()).hexdigest()
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT target_text FROM translations
+        WHERE hash = ?
+        ORDER BY used_count DESC, created_at DESC
+        LIMIT 1
+    ''', (text_hash,))
+    result = cursor.fetchone()
+    if result:
+        cursor.execute('UPDATE translations SET used_count = used_count + 1 WHERE hash = ?', (text_hash,))
+        conn.commit()
+    conn.close()
+    return result[0] if result else None
+
+
+def legacy_save_translation(db_path, source_text, target_text, source_lang, target_lang, provider):
+    """舊版保存方式：每條記錄單獨連接並提交"""
+    text_hash = hashlib.md5(f"{source_text}{source_lang}{target_lang}".encode()).hexdigest()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        INSERT OR REPLACE INTO translations
+        (source_text, target_text, source_lang, target_lang, provider, hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (source_text, target_text, source_lang, target_lang, provider, text_hash))
+    conn.commit()
+    conn.close()
+
+
+def measure(label, lookups, func):
+    """執行操作並輸出每秒次數"""
+    start = time.perf_counter()
+    for i in range(lookups):
+        func(i)
+    elapsed = time.perf_counter() - start
+    rate = lookups / elapsed if elapsed > 0 else float('inf')
+    print(f"   {label:<12} {lookups} 次操作 {elapsed:.3f}s  ({rate:,.0f} 次/秒)")
+    return rate
+
+
+def benchmark_lookups(rows, lookups):
+    """連接池及前置緩存前後的查詢吞吐量"""
+    db_path = tempfile.mktemp(suffix='.db')
+    # 關閉前置緩存，只測量連接池
+    memory = TranslationMemory(db_path, cache_size=0)
+    cached_memory = TranslationMemory(db_path, cache_size=rows)
+
+    try:
+        populate(memory, rows)
+        print(f"📊 查詢吞吐量（{rows} 條記錄）:")
+
+        before = measure("舊版連接", lookups, lambda i: legacy_get_translation(
+            db_path, f"Benchmark sentence {i % rows}", "en", "zh-TW"))
+        pooled = measure("連接池", lookups, lambda i: memory.get_translation(
+            f"Benchmark sentence {i % rows}", "en", "zh-TW", "bench"))
+        # 預熱前置緩存
+        for i in range(rows):
+            cached_memory.get_translation(f"Benchmark sentence {i}", "en", "zh-TW", "bench")
+        cached = measure("前置緩存", lookups, lambda i: cached_memory.get_translation(
+            f"Benchmark sentence {i % rows}", "en", "zh-TW", "bench"))
+
+        print(f"   連接池加速比: {pooled / before:.1f}x")
+        print(f"   前置緩存加速比: {cached / before:.1f}x")
+        print(f"   前置緩存統計: {cached_memory.get_cache_stats()}")
+    finally:
+        memory.close()
+        cached_memory.close()
+        remove_database(db_path)
+
+
+def benchmark_writes(rows):
+    """逐條提交與延遲批量寫入的保存吞吐量"""
+    db_path = tempfile.mktemp(suffix='.db')
+    memory = TranslationMemory(db_path, cache_size=0)
+
+    def write_behind(i):
+        memory.save_translation(f"Write-behind sentence {i}", f"延遲寫入句子 {i}", "en", "zh-TW", "bench")
+        if i == rows - 1:
+            memory.flush()
+
+    try:
+        print(f"📊 保存吞吐量（{rows} 條記錄）:")
+        before = measure("逐條提交", rows, lambda i: legacy_save_translation(
+            db_path, f"Legacy sentence {i}", f"舊版句子 {i}", "en", "zh-TW", "bench"))
+        after = measure("延遲寫入", rows, write_behind)
+        print(f"   加速比: {after / before:.1f}x")
+    finally:
+        memory.close()
+        remove_database(db_path)
+
+
+def benchmark_bulk(rows):
+    """逐條查詢/保存與批量接口的整批耗時"""
+    db_path = tempfile.mktemp(suffix='.db')
+    # 關閉前置緩存，測量資料庫訪問
+    memory = TranslationMemory(db_path, cache_size=0)
+    lines = [f"Batch line {i}" for i in range(rows)]
+
+    def timed(label, func):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print(f"   {label:<12} {elapsed * 1000:8.1f} ms")
+        return elapsed
+
+    try:
+        print(f"📊 批量接口（{rows} 行）:")
+        per_line_save = timed("逐條保存", lambda: [
+            legacy_save_translation(db_path, line, f"批量 {line}", "en", "zh-TW", "bench") for line in lines])
+        bulk_save = timed("批量保存", lambda: memory.save_translations_bulk(
+            [(line, f"批量 {line}", "en", "zh-TW", "bench") for line in lines]))
+        per_line_get = timed("逐條查詢", lambda: [
+            legacy_get_translation(db_path, line, "en", "zh-TW") for line in lines])
+        bulk_get = timed("批量查詢", lambda: memory.get_translations_bulk(lines, "en", "zh-TW", "bench"))
+        print(f"   保存加速比: {per_line_save / bulk_save:.1f}x  查詢加速比: {per_line_get / bulk_get:.1f}x")
+    finally:
+        memory.close()
+        remove_database(db_path)
+
+
+HISTORY_QUERY = '''
+    SELECT source_text, target_text, source_lang, target_lang, provider, used_count
+    FROM translations
+    ORDER BY used_count DESC, created_at DESC
+    LIMIT 1000
+'''
+
+LANG_PAIR_QUERY = '''
+    SELECT source_text, target_text, used_count
+    FROM translations
+    WHERE source_lang = ? AND target_lang = ?
+    ORDER BY used_count DESC, created_at DESC
+    LIMIT 1000
+'''
+
+SEARCH_LIKE_QUERY = '''
+    SELECT source_text, target_text, used_count
+    FROM translations
+    WHERE source_text LIKE ? OR target_text LIKE ?
+    ORDER BY used_count DESC, created_at DESC
+    LIMIT 500
+'''
+
+
+def populate_bulk(memory, rows):
+    """直接批量寫入大量測試數據"""
+    pairs = [("en", "zh-TW"), ("ja", "zh-TW"), ("zh-TW", "en"), ("ko", "en")]
+    with memory.connection() as conn:
+        with conn:
+            conn.executemany(memory.UPSERT_TRANSLATION_SQL, (
+                (f"History sentence {i}", f"歷史句子 {i}", *pairs[i % len(pairs)], "bench", "", f"bulk-{i}", f"bulk-source-{i}")
+                for i in range(rows)
+            ))
+            conn.execute("UPDATE translations SET used_count = abs(random()) % 100")
+
+
+def time_query(conn, label, sql, params=(), repeats=5):
+    """執行查詢數次並輸出平均延遲"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        conn.execute(sql, params).fetchall()
+    elapsed = (time.perf_counter() - start) / repeats
+    print(f"   {label:<16} {elapsed * 1000:8.1f} ms")
+
+
+def benchmark_history(rows):
+    """歷史查詢在遷移（建立索引）前後的延遲"""
+    db_path = tempfile.mktemp(suffix='.db')
+    memory = TranslationMemory(db_path)
+
+    try:
+        print(f"📊 歷史查詢（{rows:,} 條記錄）:")
+        populate_bulk(memory, rows)
+
+        # 退回到v1結構，模擬舊版用戶資料庫
+        with memory.connection() as conn:
+            conn.execute("DROP INDEX idx_translations_usage")
+            conn.execute("DROP INDEX idx_translations_lang_pair")
+            for trigger in ('insert', 'delete', 'update'):
+                conn.execute(f"DROP TRIGGER IF EXISTS translations_fts_{trigger}")
+            conn.execute("DROP TABLE IF EXISTS translations_fts")
+            conn.execute("DROP INDEX IF EXISTS idx_translations_source_hash")
+            conn.execute("ALTER TABLE translations DROP COLUMN source_hash")
+            conn.execute("ALTER TABLE translations DROP COLUMN model")
+            conn.execute("PRAGMA user_version = 1")
+            time_query(conn, "歷史排序（舊）", HISTORY_QUERY)
+            time_query(conn, "語言對（舊）", LANG_PAIR_QUERY, ("ja", "zh-TW"))
+            time_query(conn, "LIKE搜索（舊）", SEARCH_LIKE_QUERY, ("%句子 12345%", "%句子 12345%"))
+        memory.close()
+
+        start = time.perf_counter()
+        memory = TranslationMemory(db_path)
+        print(f"   就地遷移耗時       {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+        with memory.connection() as conn:
+            time_query(conn, "歷史排序（新）", HISTORY_QUERY)
+            time_query(conn, "語言對（新）", LANG_PAIR_QUERY, ("ja", "zh-TW"))
+
+        start = time.perf_counter()
+        for _ in range(5):
+            memory.search_history("句子 12345", 500)
+        print(f"   {'全文搜索（新）':<16} {(time.perf_counter() - start) / 5 * 1000:8.1f} ms")
+    finally:
+        memory.close()
+        remove_database(db_path)
+
+
+def random_sentences(rows, seed=42):
+    """生成隨機詞組成的測試句子"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+             for _ in range(5000)]
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(4, 16))) + '.' for _ in range(rows)]
+
+
+def benchmark_fuzzy(rows, lookups=500):
+    """大型記憶庫上的近似匹配延遲"""
+    db_path = tempfile.mktemp(suffix='.db')
+    memory = TranslationMemory(db_path)
+    sentences = random_sentences(rows)
+
+    try:
+        print(f"📊 近似匹配（{rows:,} 條記錄）:")
+        start = time.perf_counter()
+        with memory.connection() as conn:
+            with conn:
+                records = [(text, f"譯文 {i}", "en", "zh-TW", "bench", "",
+                            memory.make_hash(text, "en", "zh-TW", "bench"), memory.make_hash(text, "en", "zh-TW"))
+                           for i, text in enumerate(sentences)]
+                conn.executemany(memory.UPSERT_TRANSLATION_SQL, records)
+                memory._index_fuzzy(conn, [(row[6], row[0], row[2], row[3]) for row in records])
+        print(f"   建立索引耗時       {time.perf_counter() - start:8.1f} s")
+
+        # 句末標點改變或多一個逗號的近似句子
+        rng = random.Random(7)
+        queries = []
+        for text in rng.sample(sentences, lookups):
+            queries.append(text[:-1] + '!' if rng.random() < 0.5 else text.replace(' ', ', ', 1))
+
+        latencies = []
+        hits = 0
+        for query in queries:
+            start = time.perf_counter()
+            hits += memory.find_similar(query, "en", "zh-TW") is not None
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+
+        print(f"   平均延遲           {sum(latencies) / len(latencies) * 1000:8.2f} ms")
+        print(f"   P95延遲            {latencies[int(len(latencies) * 0.95)] * 1000:8.2f} ms")
+        print(f"   命中率             {hits / lookups:8.1%}")
+    finally:
+        memory.close()
+        remove_database(db_path)
+
+
+def clipboard_variants(text, rng):
+    """模擬同一段文字從不同來源複製時的常見差異"""
+    variants = [
+        text,
+        text + "\n",                                         # 行尾換行
+        text.replace("\n", "\r\n"),                          # Windows換行
+        "  " + text + " ",                                   # 首尾空白
+        unicodedata.normalize('NFD', text),                  # 組合字符
+        text.replace(",", "，").replace("?", "？").replace("!", "！"),  # 全形標點
+    ]
+    return rng.choice(variants)
+
+
+def benchmark_normalization(rows, copies=5):
+    """原始文本hash與規範化鍵在模擬剪貼板流量上的命中率"""
+    rng = random.Random(3)
+    bases = [f"Café {sentence[:-1]}, résumé?" for sentence in random_sentences(rows, seed=11)]
+    # 第二行模擬多行選取
+    bases = [text + "\nSecond line" if i % 4 == 0 else text for i, text in enumerate(bases)]
+    traffic = [clipboard_variants(text, rng) for text in bases for _ in range(copies)]
+    rng.shuffle(traffic)
+
+    legacy_seen, normalized_seen = set(), set()
+    legacy_hits = normalized_hits = 0
+    for text in traffic:
+        legacy_key = hashlib.md5(f"{text}enzh-TW".encode()).hexdigest()
+        normalized_key = TranslationMemory.make_hash(text, "en", "zh-TW", "google")
+        legacy_hits += legacy_key in legacy_seen
+        normalized_hits += normalized_key in normalized_seen
+        legacy_seen.add(legacy_key)
+        normalized_seen.add(normalized_key)
+
+    print(f"📊 剪貼板流量命中率（{len(traffic)} 次複製，{rows} 段不同文字）:")
+    print(f"   原始hash           {legacy_hits / len(traffic):8.1%}")
+    print(f"   規範化鍵           {normalized_hits / len(traffic):8.1%}")
+    print(f"   理論上限           {1 - rows / len(traffic):8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="翻譯記憶庫性能基準測試",
+        epilog="默認規模只需數秒；評估大型記憶庫時可使用 --history-rows 1000000 --fuzzy-rows 500000"
+               "（需要數分鐘及數GB磁盤空間）")
+    parser.add_argument('--rows', type=int, default=1000, help="測試記錄數量")
+    parser.add_argument('--lookups', type=int, default=2000, help="查詢次數")
+    parser.add_argument('--batch-rows', type=int, default=5000, help="批量接口測試的行數")
+    parser.add_argument('--history-rows', type=int, default=10000, help="歷史查詢測試的記錄數量（0為跳過）")
+    parser.add_argument('--fuzzy-rows', type=int, default=5000, help="近似匹配測試的記錄數量（0為跳過）")
+    args = parser.parse_args()
+
+    benchmark_lookups(args.rows, args.lookups)
+    benchmark_writes(args.rows)
+    benchmark_normalization(args.rows)
+    benchmark_bulk(args.batch_rows)
+    if args.history_rows:
+        benchmark_history(args.history_rows)
+    if args.fuzzy_rows:
+        benchmark_fuzzy(args.fuzzy_rows)
+
+
+if __name__ == "__main__":
+    main()
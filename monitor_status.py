@@ -12,11 +12,14 @@ import os
 import pyperclip
 import threading
 from datetime import datetime
+from urllib.request import pathname2url
 
 class TranslatorMonitor:
     def __init__(self):
         self.config_file = "config.json"
         self.db_file = "translation_memory.db"
+        self.status_file = "service_status.json"
+        self.metrics_file = "provider_metrics.db"
         self.monitor_running = True
         
     def load_config(self):
@@ -60,28 +63,91 @@ class TranslatorMonitor:
                 print("❌ 翻譯記憶庫資料庫不存在")
                 return False
                 
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            # 只讀連接：不執行結構遷移、不啟動寫入線程（WAL模式下不會阻塞運行中的翻譯器）
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.db_file))}?mode=ro", uri=True)
+            try:
+                cursor = conn.cursor()
+                
+                # 檢查表是否存在
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                tables = [row[0] for row in cursor.fetchall()]
+                
+                print(f"✅ 資料庫連接正常，包含表格: {', '.join(tables)}")
+                
+                # 檢查翻譯記錄數量
+                if 'translations' in tables:
+                    cursor.execute("SELECT COUNT(*) FROM translations")
+                    count = cursor.fetchone()[0]
+                    print(f"   翻譯記錄數量: {count}")
+                
+                journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+                print(f"   日誌模式: {journal_mode}")
+            finally:
+                conn.close()
             
-            # 檢查表是否存在
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+            return True
             
-            print(f"✅ 資料庫連接正常，包含表格: {', '.join(tables)}")
+        except Exception as e:
+            print(f"❌ 資料庫檢查失敗: {e}")
+            return False
+    
+    def check_service_status(self):
+        """檢查翻譯服務熔斷器狀態（由運行中的翻譯器寫入）"""
+        try:
+            if not os.path.exists(self.status_file):
+                print("⚠️ 未找到服務狀態文件（翻譯器尚未運行）")
+                return True
             
-            # 檢查翻譯記錄數量
-            if 'translations' in tables:
-                cursor.execute("SELECT COUNT(*) FROM translations")
-                count = cursor.fetchone()[0]
-                print(f"   翻譯記錄數量: {count}")
+            with open(self.status_file, 'r', encoding='utf-8') as f:
+                status = json.load(f)
             
-            conn.close()
-            return True
+            updated_at = datetime.fromtimestamp(status.get('updated_at', 0)).strftime('%Y-%m-%d %H:%M:%S')
+            providers = status.get('providers', {})
+            all_ok = True
+            for provider, info in providers.items():
+                state = info.get('state')
+                if state == 'closed':
+                    print(f"✅ {provider}: 正常")
+                elif state == 'half_open':
+                    print(f"⚠️ {provider}: 正在探測恢復")
+                else:
+                    all_ok = False
+                    print(f"❌ {provider}: 暫停使用（連續失敗 {info.get('failures', 0)} 次）")
+                    if info.get('last_error'):
+                        print(f"   最近錯誤: {info['last_error']}")
+            print(f"   狀態更新時間: {updated_at}")
+            return all_ok
             
         except Exception as e:
-            print(f"❌ 資料庫檢查失敗: {e}")
+            print(f"❌ 服務狀態讀取失敗: {e}")
             return False
     
+    def show_provider_metrics(self, days=7):
+        """顯示各翻譯服務按語言對的延遲百分位及錯誤率"""
+        if not os.path.exists(self.metrics_file):
+            print("⚠️ 暫無服務指標數據")
+            return
+        
+        from translator import ProviderMetrics
+        metrics = ProviderMetrics(self.metrics_file)
+        try:
+            report = metrics.latency_report(days)
+        finally:
+            metrics.close()
+        
+        if not report:
+            print(f"⚠️ 最近{days}天沒有請求記錄")
+            return
+        
+        def ms(value):
+            return f"{value:.0f}" if value is not None else "-"
+        
+        print(f"   {'服務':<12}{'語言對':<14}{'請求':>6}{'緩存':>6}{'錯誤率':>8}{'p50':>8}{'p95':>8}{'p99':>8}  (毫秒)")
+        for row in report:
+            pair = f"{row['source_lang']}->{row['target_lang']}"
+            print(f"   {row['provider']:<12}{pair:<14}{row['requests']:>6}{row['cache_hits']:>6}"
+                  f"{row['error_rate']:>8.1%}{ms(row['p50']):>8}{ms(row['p95']):>8}{ms(row['p99']):>8}")
+    
     def check_clipboard_function(self):
         """檢查剪貼簿功能"""
         try:
@@ -154,6 +220,9 @@ class TranslatorMonitor:
                     print("❗ 翻譯器進程已停止，請重新啟動")
                     break
                 
+                # 檢查翻譯服務狀態
+                self.check_service_status()
+                
                 # 每30秒檢查一次
                 time.sleep(30)
                 
@@ -177,11 +246,17 @@ class TranslatorMonitor:
         print("\n3. 檢查資料庫:")
         db_ok = self.check_database_status()
         
-        # 4. 檢查剪貼簿功能
-        print("\n4. 檢查剪貼簿功能:")
+        # 4. 檢查翻譯服務狀態
+        print("\n4. 檢查翻譯服務狀態:")
+        services_ok = self.check_service_status()
+        print("\n   最近7天服務延遲:")
+        self.show_provider_metrics()
+        
+        # 5. 檢查剪貼簿功能
+        print("\n5. 檢查剪貼簿功能:")
         clipboard_ok = self.check_clipboard_function()
         
-        # 5. 測試翻譯功能
+        # 6. 測試翻譯功能
         if process_ok:
             self.test_translation_function()
         
@@ -191,9 +266,10 @@ class TranslatorMonitor:
         print(f"   進程狀態: {'✅' if process_ok else '❌'}")
         print(f"   配置文件: {'✅' if config_ok else '❌'}")
         print(f"   資料庫: {'✅' if db_ok else '❌'}")
+        print(f"   翻譯服務: {'✅' if services_ok else '❌'}")
         print(f"   剪貼簿: {'✅' if clipboard_ok else '❌'}")
         
-        overall_status = all([process_ok, config_ok, db_ok, clipboard_ok])
+        overall_status = all([process_ok, config_ok, db_ok, services_ok, clipboard_ok])
         print(f"\n整體狀態: {'✅ 正常' if overall_status else '❌ 有問題'}")
         
         return overall_status
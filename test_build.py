@@ -649,8 +649,8 @@ class TestTranslationMemoryGUI(unittest.TestCase):
         except Exception as e:
             self.fail(f"Error testing translation memory database: {e}")
     
-    def test_translation_worker_integration(self):
-        """Test translation worker thread integration"""
+    def test_translation_engine_integration(self):
+        """Test translation engine integration"""
         try:
             import translator
             import tempfile
@@ -667,17 +667,17 @@ class TestTranslationMemoryGUI(unittest.TestCase):
                 }
                 memory = translator.TranslationMemory(temp_db.name)
                 
-                # Test worker creation
-                worker = translator.TranslationWorker("Hello", config, memory, "en", "zh-TW")
-                self.assertIsInstance(worker, QThread, "Worker should be a QThread")
-                self.assertIsNotNone(worker.translation_complete, "Should have translation_complete signal")
-                self.assertIsNotNone(worker.translation_error, "Should have translation_error signal")
+                # Test engine creation
+                engine = translator.TranslationEngine(config, memory)
+                request = engine.new_request("Hello", "en", "zh-TW")
+                self.assertIsNotNone(engine.router, "Engine should hold a translation router")
+                self.assertEqual(request.target_lang, "zh-TW", "Request should keep its language pair")
             finally:
                 if os.path.exists(temp_db.name):
                     os.unlink(temp_db.name)
             
         except Exception as e:
-            self.fail(f"Error testing translation worker integration: {e}")
+            self.fail(f"Error testing translation engine integration: {e}")
 
 @unittest.skipIf(not PYQT_AVAILABLE, f"PyQt not available for GUI testing")
 class TestSystemTrayIntegration(unittest.TestCase):
@@ -1146,9 +1146,9 @@ class TestHotkeyFunctionality(unittest.TestCase):
                 test_result = detector.detect_language("Hello world")
                 self.assertIsInstance(test_result, str, "Language detection should return a string")
                 
-                # Test translation worker creation
-                worker = translator.TranslationWorker("test text", test_config, memory, 'auto', 'zh-TW')
-                self.assertIsNotNone(worker, "TranslationWorker should be created successfully")
+                # Test translation engine creation
+                engine = translator.TranslationEngine(test_config, memory)
+                self.assertIsNotNone(engine, "TranslationEngine should be created successfully")
                 
                 print("✅ Copy detection functionality test passed")
                 
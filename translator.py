@@ -5,6 +5,9 @@ import json
 import requests
 import sqlite3
 import hashlib
+import difflib
+import zlib
+import unicodedata
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any
 from PyQt5.QtWidgets import (QApplication, QSystemTrayIcon, QMenu, 
@@ -21,9 +24,17 @@ import tempfile
 import subprocess
 import re
 import time
+import random
 import threading
-from urllib.parse import quote
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import quote, urlencode
+from email.utils import parsedate_to_datetime
 import base64
+import html
+import importlib.util
 
 def resource_path(relative_path):
     """獲取資源的絕對路徑"""
@@ -505,6 +516,19 @@ class MultiServiceTranslator:
         self.active_service = "google"
         self.service_order = ["google", "deepl", "microsoft", "yandex", "baidu"]
     
+    @staticmethod
+    def adaptive_order(services: List[str], source_lang: str, target_lang: str,
+                       metrics: 'ProviderMetrics' = None) -> List[str]:
+        """按語言對的近期評分（延遲及錯誤率）排序服務
+        
+        只在有足夠樣本的服務之間調整順序，樣本不足的服務保持原位，以便繼續收集數據
+        """
+        metrics = metrics or ProviderMetrics.get()
+        scores = {service: metrics.score(service, source_lang, target_lang) for service in services}
+        ranked = iter(sorted((service for service in services if scores[service] is not None),
+                             key=lambda service: scores[service]))
+        return [next(ranked) if scores[service] is not None else service for service in services]
+    
     def get_service_info(self, service_name: str) -> Dict[str, Any]:
         """Get service information"""
         return self.services.get(service_name, {})
@@ -580,17 +604,396 @@ class SpeechManager:
         except Exception as e:
             print(f"STT error: {e}")
 
+class TranslationCache:
+    """翻譯結果的記憶體LRU緩存 - 位於SQLite記憶庫之前，線程共享"""
+    
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds or None
+        self.max_bytes = max_bytes or None
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def entry_size(key: tuple, value: str) -> int:
+        """估算條目佔用的字節數"""
+        return len(value.encode('utf-8')) + sum(len(str(part).encode('utf-8')) for part in key)
+    
+    def get(self, key: tuple) -> Optional[str]:
+        """讀取緩存，命中時移到最近使用位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: tuple, value: str):
+        """寫入緩存，超出條目數或字節數限制時淘汰最久未使用的條目"""
+        if self.max_entries <= 0:
+            return
+        
+        size = self.entry_size(key, value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+    
+    def invalidate(self, key: tuple):
+        """移除單個條目"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+    
+    def clear(self):
+        """清空緩存"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+    
+    def _remove(self, key: tuple):
+        """移除條目（調用者需持有鎖）"""
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取命中/未命中/淘汰統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+    
+    def __len__(self):
+        return len(self._entries)
+
+class FuzzyMatcher:
+    """近似匹配索引 - 字符三元組MinHash簽名分段（LSH），避免線性掃描整個記憶庫"""
+    
+    NUM_BINS = 48
+    BANDS = 12  # 每段4個值，Jaccard相似度約0.55以上的文本才會成為候選
+    SHINGLE_SIZE = 3
+    _MIX = 0x9E3779B97F4A7C15  # 64位乘法混合常數
+    _MASK = (1 << 64) - 1
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """統一大小寫和空白，用於簽名及相似度計算"""
+        return ' '.join(text.lower().split())
+    
+    @classmethod
+    def shingles(cls, text: str) -> set:
+        """文本的字符三元組哈希集合"""
+        text = cls.normalize(text)
+        if len(text) <= cls.SHINGLE_SIZE:
+            return {zlib.crc32(text.encode())} if text else set()
+        return {zlib.crc32(text[i:i + cls.SHINGLE_SIZE].encode())
+                for i in range(len(text) - cls.SHINGLE_SIZE + 1)}
+    
+    @classmethod
+    def signature(cls, text: str) -> List[int]:
+        """MinHash簽名（單次哈希分桶取最小值，空桶向右借值填充）"""
+        shingles = cls.shingles(text)
+        if not shingles:
+            return []
+        
+        bins = cls.NUM_BINS
+        signature = [None] * bins
+        for shingle in shingles:
+            mixed = (shingle * cls._MIX) & cls._MASK
+            index = (mixed >> 32) % bins
+            value = mixed & 0xFFFFFFFF
+            if signature[index] is None or value < signature[index]:
+                signature[index] = value
+        
+        if None in signature:
+            filled = signature[:]
+            for index in range(bins):
+                if signature[index] is None:
+                    distance = 1
+                    while signature[(index + distance) % bins] is None:
+                        distance += 1
+                    filled[index] = signature[(index + distance) % bins] + (distance << 32)
+            signature = filled
+        return signature
+    
+    @classmethod
+    def band_keys(cls, text: str, source_lang: str, target_lang: str) -> List[int]:
+        """簽名分段後的桶鍵（包含語言對），任一段相同即為候選"""
+        signature = cls.signature(text)
+        if not signature:
+            return []
+        rows = cls.NUM_BINS // cls.BANDS
+        keys = []
+        for band in range(cls.BANDS):
+            values = signature[band * rows:(band + 1) * rows]
+            digest = hashlib.blake2b(f"{source_lang}|{target_lang}|{band}|{values}".encode(), digest_size=8).digest()
+            keys.append(int.from_bytes(digest, 'big', signed=True))
+        return keys
+    
+    @classmethod
+    def similarity(cls, a: str, b: str, threshold: float = 0.0) -> float:
+        """編輯相似度（0-1），低於閾值時提前返回0（長度相差過大時不調用difflib）"""
+        a, b = cls.normalize(a), cls.normalize(b)
+        if a == b:
+            return 1.0
+        if 2 * min(len(a), len(b)) < threshold * (len(a) + len(b)):
+            return 0.0
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+            return 0.0
+        return matcher.ratio()
+
 class TranslationMemory:
     """翻譯記憶庫 - 靈感來自qTranslate-XT的內容管理"""
-    def __init__(self, db_path="translation_memory.db"):
+    
+    # 每個新連接套用的PRAGMA設定
+    CONNECTION_PRAGMAS = (
+        ('auto_vacuum', 'INCREMENTAL'), # 新資料庫須在建表前設定，清理後可逐步歸還空間
+        ('journal_mode', 'WAL'),        # 讀寫不互斥，提交只需追加WAL
+        ('synchronous', 'NORMAL'),      # WAL模式下NORMAL已保證一致性
+        ('temp_store', 'MEMORY'),
+        ('cache_size', -8000),          # 約8MB頁面緩存
+        ('mmap_size', 67108864),        # 64MB記憶體映射
+        ('busy_timeout', 5000),
+    )
+    STATEMENT_CACHE_SIZE = 128  # 每個連接保留的預編譯語句數量
+    POOL_SIZE = 8  # 連接池最大連接數
+    
+    # 延遲寫入：批量提交新翻譯及使用計數
+    UPSERT_TRANSLATION_SQL = '''
+        INSERT INTO translations 
+        (source_text, target_text, source_lang, target_lang, provider, model, hash, source_hash) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET
+            source_text = excluded.source_text,
+            target_text = excluded.target_text,
+            provider = excluded.provider,
+            model = excluded.model,
+            created_at = CURRENT_TIMESTAMP
+    '''
+    INCREMENT_USAGE_SQL = 'UPDATE translations SET used_count = used_count + ? WHERE hash = ?'
+    INDEX_FUZZY_SQL = '''
+        INSERT OR IGNORE INTO translation_bands (band_key, translation_id)
+        SELECT ?, id FROM translations WHERE hash = ?
+    '''
+    FUZZY_CANDIDATE_LIMIT = 20  # 按命中段數排序後最多驗證的候選數
+    FUZZY_MAX_CHARS = 1000      # 超過此長度的文本不做近似匹配（difflib耗時隨長度平方增長）
+    
+    # 搜索結果片段中的高亮標記（私用區字符，不會出現在正常文本中）
+    HIGHLIGHT_START = '\ue000'
+    HIGHLIGHT_END = '\ue001'
+    
+    def __init__(self, db_path="translation_memory.db", pool_size=None, cache_size=1000,
+                 cache_ttl=None, cache_max_bytes=None, flush_interval_ms=500, flush_batch_size=100,
+                 fts_tokenizer="trigram", similarity_threshold=0.9, max_entries=None,
+                 cleanup_threshold=None, on_cleanup=None):
         self.db_path = db_path
+        # 記錄數超過cleanup_threshold時，由後台線程淘汰到max_entries
+        self.max_entries = max_entries
+        self.cleanup_threshold = cleanup_threshold
+        self.on_cleanup = on_cleanup  # 清理完成回調（在後台線程中調用）
+        self.last_cleanup = None
+        self._rows_added = False
+        # 近似匹配的最低相似度，1.0以上即只做精確匹配
+        self.similarity_threshold = similarity_threshold
+        # 全文索引分詞器：trigram支持中日韓文子串搜索，unicode61按詞切分
+        self.fts_tokenizer = fts_tokenizer
+        # 記憶體前置緩存，重複查詢不需訪問SQLite
+        self.cache = TranslationCache(cache_size, cache_ttl, cache_max_bytes)
+        # 句子級查詢統計（長文本按句查詢記憶庫時由緩存提供的句子及字符數）
+        self._segment_stats = {'lookups': 0, 'segments': 0, 'cached_segments': 0, 'chars': 0, 'cached_chars': 0}
+        self._segment_stats_lock = threading.Lock()
+        # 記憶體資料庫每個連接都是獨立的，只能共用同一個連接
+        if db_path == ":memory:":
+            pool_size = 1
+        self.pool_size = pool_size or self.POOL_SIZE
+        self._idle_connections = []
+        self._all_connections = []
+        self._pool_condition = threading.Condition()
+        self._closed = False
         self.init_database()
+        
+        # 延遲寫入隊列（按hash合併），由後台線程定期提交
+        self.flush_interval = max(flush_interval_ms, 10) / 1000.0
+        self.flush_batch_size = max(flush_batch_size, 1)
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._vacuuming = False    # 轉換auto_vacuum期間界面讀取不等待提交
+        self._pending_saves = {}   # hash -> 翻譯記錄
+        self._pending_usage = {}   # hash -> 使用次數增量
+        self._inflight_saves = {}  # 正在提交中的翻譯記錄
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="TranslationMemoryWriter", daemon=True)
+        self._writer_thread.start()
+    
+    @classmethod
+    def from_config(cls, config: dict, db_path: str = "translation_memory.db", **kwargs) -> 'TranslationMemory':
+        """按配置文件的translation及translation_memory設定創建記憶庫"""
+        translation_config = config.get('translation', {})
+        memory_config = config.get('translation_memory', {})
+        return cls(
+            db_path,
+            cache_size=translation_config.get('cache_size', 1000),
+            cache_ttl=translation_config.get('cache_ttl'),
+            cache_max_bytes=translation_config.get('cache_max_bytes'),
+            flush_interval_ms=memory_config.get('flush_interval_ms', 500),
+            flush_batch_size=memory_config.get('flush_batch_size', 100),
+            fts_tokenizer=memory_config.get('fts_tokenizer', 'trigram'),
+            similarity_threshold=memory_config.get('similarity_threshold', 0.9),
+            max_entries=memory_config.get('max_entries'),
+            cleanup_threshold=memory_config.get('cleanup_threshold'),
+            **kwargs
+        )
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        """創建並調整一個新的資料庫連接"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=5.0,
+            check_same_thread=False,  # 連接在線程間借用，同一時間只屬於一個線程
+            cached_statements=self.STATEMENT_CACHE_SIZE
+        )
+        for name, value in self.CONNECTION_PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+    
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """從連接池借出一個連接"""
+        with self._pool_condition:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("翻譯記憶庫已關閉")
+                if self._idle_connections:
+                    return self._idle_connections.pop()
+                if len(self._all_connections) < self.pool_size:
+                    conn = self._create_connection()
+                    self._all_connections.append(conn)
+                    return conn
+                self._pool_condition.wait()
+    
+    def _release_connection(self, conn: sqlite3.Connection):
+        """歸還連接到連接池"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._pool_condition:
+            if self._closed:
+                conn.close()
+                self._all_connections.remove(conn)
+            else:
+                self._idle_connections.append(conn)
+            self._pool_condition.notify()
+    
+    @contextmanager
+    def connection(self):
+        """借用連接池中的連接，使用完畢後自動歸還"""
+        conn = self._acquire_connection()
+        try:
+            yield conn
+        finally:
+            self._release_connection(conn)
+    
+    def close(self):
+        """提交所有待寫入數據並關閉連接池中的所有連接"""
+        if self._writer_thread.is_alive():
+            self._stop_event.set()
+            self._flush_event.set()
+            self._writer_thread.join()
+        
+        with self._pool_condition:
+            if self._closed:
+                return
+            self._closed = True
+            for conn in self._idle_connections:
+                conn.close()
+                self._all_connections.remove(conn)
+            self._idle_connections = []
+            self._pool_condition.notify_all()
+    
+    def get_migrations(self) -> List[Tuple[int, Any]]:
+        """結構遷移列表（版本號記錄在PRAGMA user_version中）"""
+        return [
+            (1, self._migrate_initial_schema),
+            (2, self._migrate_history_indexes),
+            (3, self._migrate_full_text_search),
+            (4, self._migrate_fuzzy_index),
+            (5, self._migrate_normalized_keys),
+        ]
     
     def init_database(self):
-        """初始化數據庫"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """初始化數據庫並套用尚未執行的結構遷移"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            
+            for target_version, migrate in self.get_migrations():
+                if version >= target_version:
+                    continue
+                
+                # 每個遷移在獨立事務中執行，失敗時回滾且版本號不變
+                cursor.execute('BEGIN')
+                try:
+                    migrate(cursor)
+                    cursor.execute(f'PRAGMA user_version = {target_version}')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                
+                print(f"[INFO] Translation memory schema migrated: v{version} -> v{target_version}")
+                version = target_version
+            
+            # 初始化語言配置（在同一個連接中）
+            self.init_language_config_data(cursor)
+            
+            conn.commit()
+            
+            # 舊資料庫需要一次完整VACUUM才能啟用增量回收，由後台寫入線程執行
+            self.needs_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2
+            
+            # 檢查全文索引是否可用（SQLite未編譯FTS5時退回LIKE搜索）
+            row = cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'translations_fts'"
+            ).fetchone()
+            self.fts_enabled = row is not None
+            self.fts_trigram = bool(row) and 'trigram' in row[0]
+    
+    def _migrate_initial_schema(self, cursor):
+        """v1: 初始表結構（舊版資料庫已存在這些表）"""
         # 創建翻譯記憶表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS translations (
@@ -631,12 +1034,68 @@ class TranslationMemory:
                 rtl BOOLEAN DEFAULT 0
             )
         ''')
+    
+    def _migrate_history_indexes(self, cursor):
+        """v2: 歷史排序及語言對索引"""
+        # 歷史列表按使用次數和時間排序，LIMIT查詢直接沿索引讀取，無需全表排序
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_translations_usage
+            ON translations (used_count DESC, created_at DESC)
+        ''')
         
-        # 初始化語言配置（在同一個連接中）
-        self.init_language_config_data(cursor)
+        # 按語言對篩選時同樣保持歷史排序
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_translations_lang_pair
+            ON translations (source_lang, target_lang, used_count DESC, created_at DESC)
+        ''')
         
-        conn.commit()
-        conn.close()
+        cursor.execute('ANALYZE translations')
+    
+    def _migrate_full_text_search(self, cursor):
+        """v3: FTS5全文索引（外部內容表，由觸發器與translations同步）"""
+        tokenizers = [self.fts_tokenizer, 'unicode61'] if self.fts_tokenizer != 'unicode61' else ['unicode61']
+        
+        for tokenizer in tokenizers:
+            try:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS translations_fts USING fts5(
+                        source_text, target_text,
+                        content='translations', content_rowid='id',
+                        tokenize='{tokenizer}'
+                    )
+                ''')
+                break
+            except sqlite3.OperationalError as e:
+                print(f"[WARNING] FTS5 tokenizer '{tokenizer}' unavailable: {e}")
+        else:
+            # 沒有FTS5支持，搜索退回LIKE
+            return
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS translations_fts_insert AFTER INSERT ON translations BEGIN
+                INSERT INTO translations_fts (rowid, source_text, target_text)
+                VALUES (new.id, new.source_text, new.target_text);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS translations_fts_delete AFTER DELETE ON translations BEGIN
+                INSERT INTO translations_fts (translations_fts, rowid, source_text, target_text)
+                VALUES ('delete', old.id, old.source_text, old.target_text);
+            END
+        ''')
+        # 只有文本列變化時才重建索引，使用計數更新不觸發
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS translations_fts_update
+            AFTER UPDATE OF source_text, target_text ON translations BEGIN
+                INSERT INTO translations_fts (translations_fts, rowid, source_text, target_text)
+                VALUES ('delete', old.id, old.source_text, old.target_text);
+                INSERT INTO translations_fts (rowid, source_text, target_text)
+                VALUES (new.id, new.source_text, new.target_text);
+            END
+        ''')
+        
+        # 為現有記錄建立索引
+        cursor.execute("INSERT INTO translations_fts (translations_fts) VALUES ('rebuild')")
     
     def init_language_config_data(self, cursor):
         """初始化語言配置數據 - 擴展qTranslate-XT的語言支持"""
@@ -665,87 +1124,2072 @@ class TranslationMemory:
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', lang)
     
-    def get_translation(self, source_text: str, source_lang: str, target_lang: str) -> Optional[str]:
-        """從記憶庫獲取翻譯"""
-        text_hash = hashlib.md5(f"{source_text}{source_lang}{target_lang}".encode()).hexdigest()
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """規範化原文：Unicode NFKC（全形/半形、組合字符）、統一換行、去除行尾及首尾空白"""
+        text = unicodedata.normalize('NFKC', text)
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+    
+    @classmethod
+    def make_key(cls, source_text: str, source_lang: str, target_lang: str,
+                 provider: str = None, model: str = None) -> tuple:
+        """生成結構化的查詢鍵（亦用作前置緩存鍵）"""
+        return (cls.normalize_text(source_text), source_lang, target_lang, provider or '', model or '')
+    
+    @classmethod
+    def make_hash(cls, source_text: str, source_lang: str, target_lang: str,
+                  provider: str = None, model: str = None) -> str:
+        """生成翻譯記錄的hash"""
+        return cls.hash_key(cls.make_key(source_text, source_lang, target_lang, provider, model))
+    
+    @staticmethod
+    def hash_key(key: tuple) -> str:
+        """查詢鍵的hash（JSON編碼各欄位，避免拼接產生歧義）"""
+        return hashlib.sha256(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    def get_translation(self, source_text: str, source_lang: str, target_lang: str,
+                        provider: str = None, model: str = None) -> Optional[str]:
+        """從記憶庫獲取翻譯（不指定提供商和模型時返回使用最多的譯文）"""
+        if provider is None and model is None:
+            return self._get_any_translation(source_text, source_lang, target_lang)
+        
+        cache_key = self.make_key(source_text, source_lang, target_lang, provider, model)
+        text_hash = self.hash_key(cache_key)
+        result = self.cache.get(cache_key)
+        
+        if result is None:
+            result = self._get_pending_translation(text_hash)
+        
+        if result is None:
+            with self.connection() as conn:
+                row = conn.execute('''
+                    SELECT target_text FROM translations 
+                    WHERE hash = ? 
+                    ORDER BY used_count DESC, created_at DESC
+                    LIMIT 1
+                ''', (text_hash,)).fetchone()
+            
+            if not row:
+                return None
+            
+            result = row[0]
+            self.cache.put(cache_key, result)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # 使用計數由後台線程批量更新，讀取不觸發寫事務
+        self._record_usage(text_hash)
+        return result
+    
+    def save_translation(self, source_text: str, target_text: str, source_lang: str, 
+                        target_lang: str, provider: str, model: str = None):
+        """保存翻譯到記憶庫（延遲寫入）"""
+        record = self._make_record(source_text, target_text, source_lang, target_lang, provider, model)
         
-        cursor.execute('''
-            SELECT target_text FROM translations 
-            WHERE hash = ? 
-            ORDER BY used_count DESC, created_at DESC
-            LIMIT 1
-        ''', (text_hash,))
+        with self._pending_lock:
+            self._pending_saves[record[6]] = record
+            pending = len(self._pending_saves) + len(self._pending_usage)
         
-        result = cursor.fetchone()
+        self.cache.put(self.make_key(source_text, source_lang, target_lang, provider, model), target_text)
         
-        if result:
-            # 增加使用計數
-            cursor.execute('UPDATE translations SET used_count = used_count + 1 WHERE hash = ?', (text_hash,))
-            conn.commit()
+        if pending >= self.flush_batch_size:
+            self._flush_event.set()
+    
+    def _make_record(self, source_text: str, target_text: str, source_lang: str, target_lang: str,
+                     provider: str, model: str = None) -> tuple:
+        """構建與UPSERT_TRANSLATION_SQL欄位對應的記錄"""
+        return (source_text, target_text, source_lang, target_lang, provider, model or '',
+                self.make_hash(source_text, source_lang, target_lang, provider, model),
+                self.make_hash(source_text, source_lang, target_lang))
+    
+    def get_translations_bulk(self, texts: List[str], source_lang: str, target_lang: str,
+                              provider: str = None, model: str = None) -> Dict[str, str]:
+        """批量查詢翻譯，返回 {原文: 譯文}（只包含命中的條目）
+        
+        緩存及待寫入隊列未命中的條目通過臨時表一次JOIN查詢。
+        """
+        any_provider = provider is None and model is None
+        results = {}
+        missing = {}  # hash -> 原文列表
+        usage = []
+        
+        for text in dict.fromkeys(texts):
+            cache_key = self.make_key(text, source_lang, target_lang, provider, model)
+            cached = None if any_provider else self.cache.get(cache_key)
+            if cached is not None:
+                results[text] = cached
+                usage.append(self.hash_key(cache_key))
+            else:
+                missing.setdefault(self.hash_key(cache_key), []).append(text)
+        
+        # 尚未提交的寫入（不指定提供商時按source_hash匹配）
+        with self._pending_lock:
+            for row in list(self._inflight_saves.values()) + list(self._pending_saves.values()):
+                text_hash = row[7] if any_provider else row[6]
+                if text_hash in missing:
+                    for text in missing.pop(text_hash):
+                        results[text] = row[1]
+                    usage.append(row[6])
+        
+        if missing:
+            column = 'source_hash' if any_provider else 'hash'
+            with self.connection() as conn:
+                with conn:
+                    conn.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_hashes (hash TEXT PRIMARY KEY)')
+                    conn.execute('DELETE FROM lookup_hashes')
+                    conn.executemany('INSERT INTO lookup_hashes (hash) VALUES (?)', [(h,) for h in missing])
+                    # 按使用次數升序，同一原文的多條記錄以使用最多的為準
+                    rows = conn.execute(f'''
+                        SELECT t.{column}, t.target_text, t.hash 
+                        FROM lookup_hashes l 
+                        JOIN translations t ON t.{column} = l.hash 
+                        ORDER BY t.used_count ASC, t.created_at ASC
+                    ''').fetchall()
+                    conn.execute('DELETE FROM lookup_hashes')
+            
+            found = {}
+            for lookup_hash, target_text, text_hash in rows:
+                found[lookup_hash] = (target_text, text_hash)
+            for lookup_hash, (target_text, text_hash) in found.items():
+                for text in missing[lookup_hash]:
+                    results[text] = target_text
+                    if not any_provider:
+                        self.cache.put(self.make_key(text, source_lang, target_lang, provider, model), target_text)
+                usage.append(text_hash)
+        
+        with self._pending_lock:
+            for text_hash in usage:
+                self._pending_usage[text_hash] = self._pending_usage.get(text_hash, 0) + 1
+        
+        return results
+    
+    def save_translations_bulk(self, rows: List[Tuple]) -> int:
+        """在一個事務中批量保存 (原文, 譯文, 源語言, 目標語言, 提供商[, 模型]) 記錄"""
+        records = {}
+        for row in rows:
+            record = self._make_record(*row)
+            records[record[6]] = record
+        if not records:
+            return 0
+        
+        # 持有寫入鎖，避免隊列中較舊的同一記錄在之後覆蓋
+        with self._flush_lock:
+            with self._pending_lock:
+                for text_hash in records:
+                    self._pending_saves.pop(text_hash, None)
+            
+            with self.connection() as conn:
+                with conn:
+                    self._write_records(conn, records.values())
+        
+        for record in records.values():
+            self.cache.put(self.make_key(record[0], record[2], record[3], record[4], record[5]), record[1])
+        self._rows_added = True
+        return len(records)
+    
+    def _write_records(self, conn, records):
+        """寫入翻譯記錄及其近似匹配索引（由調用方管理事務）"""
+        records = list(records)
+        conn.executemany(self.UPSERT_TRANSLATION_SQL, records)
+        self._index_fuzzy(conn, [(row[6], row[0], row[2], row[3]) for row in records])
+    
+    def _get_any_translation(self, source_text: str, source_lang: str, target_lang: str) -> Optional[str]:
+        """按原文和語言對查找任一提供商的譯文"""
+        source_hash = self.make_hash(source_text, source_lang, target_lang)
+        
+        with self._pending_lock:
+            rows = [row for row in list(self._pending_saves.values()) + list(self._inflight_saves.values())
+                    if row[7] == source_hash]
+        if rows:
+            row = (rows[-1][1], rows[-1][6])
+        else:
+            with self.connection() as conn:
+                row = conn.execute('''
+                    SELECT target_text, hash FROM translations 
+                    WHERE source_hash = ? 
+                    ORDER BY used_count DESC, created_at DESC
+                    LIMIT 1
+                ''', (source_hash,)).fetchone()
+            if not row:
+                return None
+        
+        self._record_usage(row[1])
+        return row[0]
+    
+    def _get_pending_translation(self, text_hash: str) -> Optional[str]:
+        """從尚未提交的寫入中查找翻譯"""
+        with self._pending_lock:
+            row = self._pending_saves.get(text_hash) or self._inflight_saves.get(text_hash)
+        return row[1] if row else None
+    
+    def _record_usage(self, text_hash: str):
+        """記錄一次使用（合併後延遲寫入）"""
+        with self._pending_lock:
+            self._pending_usage[text_hash] = self._pending_usage.get(text_hash, 0) + 1
+            pending = len(self._pending_saves) + len(self._pending_usage)
+        
+        if pending >= self.flush_batch_size:
+            self._flush_event.set()
+    
+    def _writer_loop(self):
+        """後台寫入線程：每隔flush_interval或累積flush_batch_size條時提交"""
+        if self.needs_vacuum:
+            try:
+                self.convert_auto_vacuum()
+            except Exception as e:
+                print(f"[WARNING] Translation memory auto-vacuum conversion failed (retrying next start): {e}")
+        
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+                self._maybe_cleanup()
+            except Exception as e:
+                print(f"[WARNING] Translation memory flush failed: {e}")
         
-        conn.close()
-        return result[0] if result else None
+        # 退出前提交剩餘數據
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[ERROR] Final translation memory flush failed: {e}")
     
-    def save_translation(self, source_text: str, target_text: str, source_lang: str, 
-                        target_lang: str, provider: str):
-        """保存翻譯到記憶庫"""
-        text_hash = hashlib.md5(f"{source_text}{source_lang}{target_lang}".encode()).hexdigest()
+    def convert_auto_vacuum(self):
+        """以一次完整VACUUM把舊資料庫轉為增量回收（耗時與資料庫大小成正比，不在界面線程中執行）
+        
+        不持有_flush_lock，轉換期間歷史查詢跳過提交，直接讀取已提交的數據。
+        """
+        print("[INFO] Converting translation memory to incremental auto-vacuum...")
+        start = time.perf_counter()
+        self._vacuuming = True
+        try:
+            with self.connection() as conn:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+        finally:
+            self._vacuuming = False
+        self.needs_vacuum = False
+        print(f"[INFO] Translation memory auto-vacuum conversion finished in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    
+    def flush(self) -> int:
+        """在一個事務中提交所有待寫入的翻譯及使用計數，返回提交的條目數"""
+        with self._flush_lock:
+            with self._pending_lock:
+                saves, self._pending_saves = self._pending_saves, {}
+                usage, self._pending_usage = self._pending_usage, {}
+                self._inflight_saves = saves
+            
+            if not saves and not usage:
+                return 0
+            
+            try:
+                with self.connection() as conn:
+                    with conn:
+                        if saves:
+                            self._write_records(conn, saves.values())
+                        if usage:
+                            conn.executemany(self.INCREMENT_USAGE_SQL,
+                                             [(count, text_hash) for text_hash, count in usage.items()])
+            except Exception:
+                # 提交失敗時放回隊列，避免丟失數據
+                with self._pending_lock:
+                    for text_hash, row in saves.items():
+                        self._pending_saves.setdefault(text_hash, row)
+                    for text_hash, count in usage.items():
+                        self._pending_usage[text_hash] = self._pending_usage.get(text_hash, 0) + count
+                raise
+            finally:
+                with self._pending_lock:
+                    self._inflight_saves = {}
+            
+            if saves:
+                self._rows_added = True
+            return len(saves) + len(usage)
+    
+    def _maybe_cleanup(self):
+        """新記錄提交後檢查記錄數，超過清理閾值時執行淘汰"""
+        if not self.cleanup_threshold or not self._rows_added:
+            return
+        self._rows_added = False
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        if count > self.cleanup_threshold:
+            self.cleanup()
+    
+    def cleanup(self, max_entries: int = None) -> Dict[str, Any]:
+        """淘汰使用最少、最舊的記錄直到不超過max_entries，並增量回收空間"""
+        max_entries = self.max_entries if max_entries is None else max_entries
+        if max_entries is None:
+            return None
+        
+        start = time.perf_counter()
+        self.flush()
+        
+        with self.connection() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+            excess = max(count - max_entries, 0)
+            evicted = conn.execute('''
+                SELECT id, source_text, source_lang, target_lang, provider, model FROM translations 
+                ORDER BY used_count ASC, created_at ASC 
+                LIMIT ?
+            ''', (excess,)).fetchall()
+            
+            with conn:
+                conn.executemany('DELETE FROM translations WHERE id = ?', [(row[0],) for row in evicted])
+            
+            # 將空閒頁歸還給文件系統（不阻塞讀取的增量回收）
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+            freed_pages = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+        
+        for _, source_text, source_lang, target_lang, provider, model in evicted:
+            self.cache.invalidate(self.make_key(source_text, source_lang, target_lang, provider, model))
+        
+        report = {
+            'removed': len(evicted),
+            'remaining': count - len(evicted),
+            'freed_pages': freed_pages,
+            'elapsed_ms': (time.perf_counter() - start) * 1000,
+        }
+        self.last_cleanup = report
+        print(f"[INFO] Translation memory cleanup: removed {report['removed']} entries, "
+              f"{report['remaining']} remaining, freed {freed_pages} pages in {report['elapsed_ms']:.0f} ms")
         
+        if self.on_cleanup:
+            try:
+                self.on_cleanup(report)
+            except Exception as e:
+                print(f"[WARNING] Cleanup callback failed: {e}")
+        return report
+    
+    def get_history(self, limit: int = 1000) -> List[Tuple]:
+        """按使用次數和時間獲取翻譯歷史"""
+        # 先提交延遲寫入的數據，確保顯示最新記錄（轉換auto_vacuum期間跳過）
+        if not self._vacuuming:
+            self.flush()
+        
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT source_text, target_text, source_lang, target_lang, provider, used_count 
+                FROM translations 
+                ORDER BY used_count DESC, created_at DESC 
+                LIMIT ?
+            ''', (limit,)).fetchall()
+    
+    def search_history(self, query: str, limit: int = 500) -> List[Tuple]:
+        """全文搜索翻譯歷史，按相關度排序
+        
+        返回 (原文, 譯文, 源語言, 目標語言, 提供商, 使用次數, 原文片段, 譯文片段)，
+        片段中的匹配部分以HIGHLIGHT_START/HIGHLIGHT_END標記。
+        """
+        if not self._vacuuming:
+            self.flush()
+        
+        query = query.strip()
+        if not query:
+            return []
+        
+        # trigram索引至少需要3個字符，更短的查詢（如兩字中文詞）退回LIKE
+        if self.fts_enabled and (not self.fts_trigram or len(query) >= 3):
+            match = '"' + query.replace('"', '""') + '"'
+            if not self.fts_trigram:
+                match += '*'
+            
+            with self.connection() as conn:
+                try:
+                    return conn.execute('''
+                        SELECT t.source_text, t.target_text, t.source_lang, t.target_lang, t.provider, t.used_count,
+                               snippet(translations_fts, 0, ?, ?, '…', 24),
+                               snippet(translations_fts, 1, ?, ?, '…', 24)
+                        FROM translations_fts
+                        JOIN translations t ON t.id = translations_fts.rowid
+                        WHERE translations_fts MATCH ?
+                        ORDER BY rank, t.used_count DESC
+                        LIMIT ?
+                    ''', (self.HIGHLIGHT_START, self.HIGHLIGHT_END,
+                          self.HIGHLIGHT_START, self.HIGHLIGHT_END, match, limit)).fetchall()
+                except sqlite3.OperationalError as e:
+                    print(f"[WARNING] Full-text search failed, falling back to LIKE: {e}")
+        
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT source_text, target_text, source_lang, target_lang, provider, used_count 
+                FROM translations 
+                WHERE source_text LIKE ? ESCAPE '\\' OR target_text LIKE ? ESCAPE '\\'
+                ORDER BY used_count DESC, created_at DESC 
+                LIMIT ?
+            ''', (pattern, pattern, limit)).fetchall()
+        
+        return [row + (self.highlight(row[0], query), self.highlight(row[1], query)) for row in rows]
+    
+    @classmethod
+    def highlight(cls, text: str, query: str, context: int = 24) -> str:
+        """標記文本中第一個匹配並截取上下文（用於LIKE搜索結果）"""
+        index = text.lower().find(query.lower())
+        if index < 0:
+            return text[:context * 2] + ('…' if len(text) > context * 2 else '')
+        
+        start = max(0, index - context)
+        end = min(len(text), index + len(query) + context)
+        return (('…' if start > 0 else '') + text[start:index] +
+                cls.HIGHLIGHT_START + text[index:index + len(query)] + cls.HIGHLIGHT_END +
+                text[index + len(query):end] + ('…' if end < len(text) else ''))
+    
+    def _migrate_fuzzy_index(self, cursor):
+        """v4: 近似匹配的MinHash分段索引"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS translation_bands (
+                band_key INTEGER NOT NULL,
+                translation_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, translation_id)
+            ) WITHOUT ROWID
+        ''')
         cursor.execute('''
-            INSERT OR REPLACE INTO translations 
-            (source_text, target_text, source_lang, target_lang, provider, hash) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (source_text, target_text, source_lang, target_lang, provider, text_hash))
+            CREATE INDEX IF NOT EXISTS idx_translation_bands_id ON translation_bands (translation_id)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS translation_bands_delete AFTER DELETE ON translations BEGIN
+                DELETE FROM translation_bands WHERE translation_id = old.id;
+            END
+        ''')
         
-        conn.commit()
-        conn.close()
+        # 為現有記錄建立索引
+        rows = cursor.execute('SELECT hash, source_text, source_lang, target_lang FROM translations').fetchall()
+        self._index_fuzzy(cursor, rows)
+    
+    def _migrate_normalized_keys(self, cursor):
+        """v5: 模型列及規範化的結構化hash，規範化後相同的記錄合併
+        
+        hash包含提供商和模型；source_hash只包含原文和語言對，用於不指定提供商的查詢。
+        """
+        cursor.execute("ALTER TABLE translations ADD COLUMN model TEXT NOT NULL DEFAULT ''")
+        cursor.execute("ALTER TABLE translations ADD COLUMN source_hash TEXT")
+        # 舊版LLM翻譯固定使用gpt-3.5-turbo
+        cursor.execute("UPDATE translations SET model = 'gpt-3.5-turbo' WHERE provider = 'custom_llm'")
+        
+        rows = cursor.execute('''
+            SELECT id, source_text, source_lang, target_lang, provider, model, used_count 
+            FROM translations 
+            ORDER BY used_count DESC, created_at DESC
+        ''').fetchall()
+        
+        # 保留使用最多的記錄，累加重複記錄的使用次數
+        kept = {}  # hash -> [id, used_count, 原文, 源語言, 目標語言]
+        duplicates = []
+        for row_id, source_text, source_lang, target_lang, provider, model, used_count in rows:
+            text_hash = self.make_hash(source_text, source_lang, target_lang, provider, model)
+            if text_hash in kept:
+                kept[text_hash][1] += used_count
+                duplicates.append((row_id,))
+            else:
+                kept[text_hash] = [row_id, used_count, source_text, source_lang, target_lang]
+        
+        # 新hash（sha256）與舊hash（md5）長度不同，更新時不會衝突
+        cursor.executemany('DELETE FROM translations WHERE id = ?', duplicates)
+        cursor.executemany('UPDATE translations SET hash = ?, used_count = ?, source_hash = ? WHERE id = ?', [
+            (text_hash, used_count, self.make_hash(source_text, source_lang, target_lang), row_id)
+            for text_hash, (row_id, used_count, source_text, source_lang, target_lang) in kept.items()
+        ])
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_translations_source_hash 
+            ON translations (source_hash, used_count DESC, created_at DESC)
+        ''')
+        if duplicates:
+            print(f"[INFO] Merged {len(duplicates)} translation memory entries with equivalent source text")
+    
+    def _index_fuzzy(self, conn, rows):
+        """為 (hash, 原文, 源語言, 目標語言) 記錄寫入近似匹配索引"""
+        conn.executemany(self.INDEX_FUZZY_SQL, (
+            (band_key, text_hash)
+            for text_hash, source_text, source_lang, target_lang in rows
+            for band_key in FuzzyMatcher.band_keys(source_text, source_lang, target_lang)
+        ))
+    
+    def find_similar(self, source_text: str, source_lang: str, target_lang: str,
+                     threshold: float = None, model: str = None) -> Optional[Tuple[str, str, float]]:
+        """查找相似度不低於閾值的最佳近似匹配，返回 (匹配原文, 譯文, 相似度)
+        
+        指定model時只匹配該模型的譯文（LLM譯文不跨模型沿用）；超過FUZZY_MAX_CHARS的文本直接返回None
+        """
+        threshold = self.similarity_threshold if threshold is None else threshold
+        if threshold > 1.0 or len(source_text) > self.FUZZY_MAX_CHARS:
+            return None
+        
+        best = None
+        candidates = []
+        
+        # 尚未提交的寫入不在索引中，直接比較
+        with self._pending_lock:
+            for row in list(self._pending_saves.values()) + list(self._inflight_saves.values()):
+                if row[2] == source_lang and row[3] == target_lang:
+                    candidates.append((row[0], row[1], row[6], row[5]))
+        
+        band_keys = FuzzyMatcher.band_keys(source_text, source_lang, target_lang)
+        if band_keys:
+            placeholders = ','.join('?' * len(band_keys))
+            with self.connection() as conn:
+                candidates += conn.execute(f'''
+                    SELECT t.source_text, t.target_text, t.hash, t.model
+                    FROM (
+                        SELECT translation_id, COUNT(*) AS hits FROM translation_bands
+                        WHERE band_key IN ({placeholders})
+                        GROUP BY translation_id
+                        ORDER BY hits DESC
+                        LIMIT ?
+                    ) AS c
+                    JOIN translations t ON t.id = c.translation_id
+                ''', (*band_keys, self.FUZZY_CANDIDATE_LIMIT)).fetchall()
+        
+        for candidate_source, candidate_target, text_hash, candidate_model in candidates:
+            if model is not None and candidate_model != model:
+                continue
+            score = FuzzyMatcher.similarity(source_text, candidate_source, threshold)
+            if score >= threshold and (best is None or score > best[2]):
+                best = (candidate_source, candidate_target, score, text_hash)
+        
+        if best is None:
+            return None
+        
+        self._record_usage(best[3])
+        return best[:3]
+    
+    def clear_translations(self):
+        """清空所有翻譯記錄及緩存"""
+        with self._flush_lock, self._pending_lock:
+            self._pending_saves.clear()
+            self._pending_usage.clear()
+        
+        with self.connection() as conn:
+            conn.execute('DELETE FROM translations')
+            conn.commit()
+        
+        self.cache.clear()
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """獲取前置緩存統計"""
+        return self.cache.get_stats()
+    
+    def record_segment_lookup(self, segments: List[str], cached: List[str]):
+        """記錄一次句子級查詢：segments為全部句子，cached為記憶庫命中的句子"""
+        with self._segment_stats_lock:
+            stats = self._segment_stats
+            stats['lookups'] += 1
+            stats['segments'] += len(segments)
+            stats['cached_segments'] += len(cached)
+            stats['chars'] += sum(len(segment) for segment in segments)
+            stats['cached_chars'] += sum(len(segment) for segment in cached)
+    
+    def get_segment_stats(self) -> Dict[str, Any]:
+        """句子級查詢統計，cached_char_ratio為由記憶庫提供的字符比例"""
+        with self._segment_stats_lock:
+            stats = dict(self._segment_stats)
+        stats['cached_char_ratio'] = stats['cached_chars'] / stats['chars'] if stats['chars'] else 0.0
+        return stats
     
     def get_enabled_languages(self) -> List[Tuple[str, str, str]]:
         """獲取啟用的語言列表"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            try:
+                result = conn.execute('''
+                    SELECT code, name, native_name FROM language_config 
+                    WHERE enabled = 1 
+                    ORDER BY name
+                ''').fetchall()
+            except sqlite3.OperationalError:
+                # 如果表不存在，返回默認語言列表
+                result = [
+                    ('zh-TW', '繁體中文', '繁體中文'),
+                    ('en', 'English', 'English'),
+                    ('ja', '日本語', '日本語'),
+                    ('ko', '한국어', '한국어'),
+                    ('es', 'Español', 'Español'),
+                    ('fr', 'Français', 'Français'),
+                    ('de', 'Deutsch', 'Deutsch'),
+                ]
+        
+        return result
+    
+    def save_multilingual_content(self, content_id: str, language: str, content: str, title: str = None):
+        """保存多語言內容"""
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO multilingual_content 
+                (content_id, language, content, title, updated_at) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (content_id, language, content, title, datetime.now().isoformat()))
+            conn.commit()
+
+class RateLimiter:
+    """令牌桶限流器 - 同一提供商的所有請求共享，限制每秒請求數"""
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = float(rate)  # 每秒補充的令牌數，0為不限流
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_provider(cls, provider: str, rate: float, burst: int = None) -> 'RateLimiter':
+        """獲取提供商共享的限流器（配置改變時重建）"""
+        with cls._instances_lock:
+            limiter = cls._instances.get(provider)
+            if limiter is None or limiter.rate != float(rate) or (burst and limiter.capacity != burst):
+                limiter = cls(rate, burst)
+                cls._instances[provider] = limiter
+            return limiter
+    
+    def acquire(self):
+        """取得一個令牌，不足時阻塞等待"""
+        if self.rate <= 0:
+            return
+        
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class SingleFlight:
+    """合併相同鍵的並發調用 - 同一時間只執行一次，其他調用等待並共享結果（或異常）"""
+    
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn) -> Tuple[Any, bool]:
+        """執行fn()或等待進行中的相同調用，返回 (結果, 是否共享了其他調用的結果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
         
         try:
-            cursor.execute('''
-                SELECT code, name, native_name FROM language_config 
-                WHERE enabled = 1 
-                ORDER BY name
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+    
+    def waiters(self, key) -> int:
+        """正在等待該鍵結果的其他調用數"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call else 0
+
+class HttpSessionManager:
+    """HTTP會話管理器 - 進程內共享的長連接池（每個主機一個連接池），
+    應用config.json中的internet（超時、User-Agent）及proxy設定，已安裝httpx[http2]時使用HTTP/2
+    """
+    
+    DEFAULT_TIMEOUT_MS = 10000
+    DEFAULT_POOL_CONNECTIONS = 10  # 保持連接池的主機數
+    DEFAULT_POOL_MAXSIZE = 10      # 每個主機保持的連接數
+    
+    # proxy.type：0 有host時手動設定否則跟隨系統（環境變量），1 直接連接，2 手動設定
+    PROXY_AUTO, PROXY_NONE, PROXY_MANUAL = 0, 1, 2
+    PROXY_SCHEMES = {0: 'http', 1: 'socks5'}
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, config: dict):
+        self.settings = self.read_settings(config)
+        self.timeout = self.settings['timeout']
+        self.user_agent = self.settings['user_agent']
+        self.proxy_url = self.settings['proxy_url']
+        self.trust_env = self.settings['trust_env']
+        self.pool_connections = self.settings['pool_connections']
+        self.pool_maxsize = self.settings['pool_maxsize']
+        self.http2 = self.settings['http2']
+        
+        self.client = self._create_http2_client() if self.http2 else None
+        self.session = None if self.client else self._create_session()
+        self._google_translator = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def read_settings(cls, config: dict) -> Dict[str, Any]:
+        """讀取影響連接的設定（任一項改變時需要重建會話）"""
+        internet_config = config.get('internet', {})
+        proxy_config = config.get('proxy', {})
+        
+        proxy_url = None
+        proxy_type = proxy_config.get('type', cls.PROXY_AUTO)
+        host = proxy_config.get('host', '')
+        if proxy_type != cls.PROXY_NONE and host:
+            scheme = cls.PROXY_SCHEMES.get(proxy_config.get('scheme', 0), 'http')
+            auth = ''
+            if proxy_config.get('username'):
+                auth = f"{quote(proxy_config['username'], safe='')}:{quote(proxy_config.get('password', ''), safe='')}@"
+            port = proxy_config.get('port')
+            proxy_url = f"{scheme}://{auth}{host}" + (f":{port}" if port else '')
+        
+        return {
+            'timeout': internet_config.get('timeout', cls.DEFAULT_TIMEOUT_MS) / 1000.0,
+            'user_agent': internet_config.get('user_agent', ''),
+            'proxy_url': proxy_url,
+            'trust_env': proxy_type == cls.PROXY_AUTO and not proxy_url,
+            'pool_connections': internet_config.get('pool_connections', cls.DEFAULT_POOL_CONNECTIONS),
+            'pool_maxsize': internet_config.get('pool_maxsize', cls.DEFAULT_POOL_MAXSIZE),
+            'http2': bool(internet_config.get('http2', True)),
+        }
+    
+    @classmethod
+    def get(cls, config: dict) -> 'HttpSessionManager':
+        """獲取共享的會話管理器（網絡設定改變時重建）"""
+        with cls._instance_lock:
+            manager = cls._instance
+            if manager is None or manager.settings != cls.read_settings(config):
+                if manager is not None:
+                    manager.close()
+                manager = cls(config)
+                cls._instance = manager
+            return manager
+    
+    @classmethod
+    def close_all(cls):
+        """關閉共享的會話（程式退出時調用）"""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close()
+                cls._instance = None
+    
+    def _create_session(self):
+        """建立requests會話，按主機保持長連接"""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.trust_env = self.trust_env
+        if self.user_agent:
+            session.headers['User-Agent'] = self.user_agent
+        if self.proxy_url:
+            session.proxies = {'http': self.proxy_url, 'https': self.proxy_url}
+        return session
+    
+    def _create_http2_client(self):
+        """建立支持HTTP/2的httpx客戶端，httpx或h2未安裝時返回None"""
+        try:
+            import httpx
+            kwargs = {
+                'http2': True,
+                'timeout': self.timeout,
+                'trust_env': self.trust_env,
+                'limits': httpx.Limits(max_connections=self.pool_connections * self.pool_maxsize,
+                                       max_keepalive_connections=self.pool_maxsize),
+                'headers': {'User-Agent': self.user_agent} if self.user_agent else None,
+            }
+            if self.proxy_url:
+                kwargs['proxy'] = self.proxy_url
+            try:
+                return httpx.Client(**kwargs)
+            except TypeError:
+                # 舊版httpx使用proxies參數
+                kwargs['proxies'] = kwargs.pop('proxy', None)
+                return httpx.Client(**kwargs)
+        except ImportError:
+            return None
+        except Exception as e:
+            print(f"[WARNING] HTTP/2 client unavailable, using requests session: {e}")
+            return None
+    
+    def post(self, url: str, **kwargs):
+        """發送POST請求（復用連接，默認使用設定的超時）"""
+        kwargs.setdefault('timeout', self.timeout)
+        if self.client is not None:
+            return self.client.post(url, **self.encode_form(kwargs))
+        return self.session.post(url, **kwargs)
+    
+    @staticmethod
+    def encode_form(kwargs: dict) -> dict:
+        """httpx的data只接受字典，表單（含重複參數的元組列表）自行編碼為content"""
+        data = kwargs.pop('data', None)
+        if data is not None:
+            kwargs['content'] = urlencode(data, doseq=True)
+            kwargs['headers'] = {'Content-Type': 'application/x-www-form-urlencoded', **(kwargs.get('headers') or {})}
+        return kwargs
+    
+    @contextmanager
+    def stream(self, url: str, **kwargs):
+        """發送POST請求並流式讀取響應（用於SSE），返回的響應可用iter_lines逐行讀取"""
+        kwargs.setdefault('timeout', self.timeout)
+        if self.client is not None:
+            with self.client.stream('POST', url, **self.encode_form(kwargs)) as response:
+                yield response
+            return
+        response = self.session.post(url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+    
+    @staticmethod
+    def iter_lines(response):
+        """逐行讀取流式響應的文本（兼容requests及httpx）"""
+        if isinstance(response, requests.Response):
+            response.encoding = response.encoding or 'utf-8'
+            return response.iter_lines(decode_unicode=True)
+        return response.iter_lines()
+    
+    def google_translator(self):
+        """共享的googletrans翻譯器（內部連接池同樣復用），googletrans未安裝時拋出ImportError"""
+        with self._lock:
+            if self._google_translator is None:
+                from googletrans import Translator
+                kwargs = {'timeout': self.timeout}
+                if self.user_agent:
+                    kwargs['user_agent'] = self.user_agent
+                if self.proxy_url:
+                    kwargs['proxies'] = {'http://': self.proxy_url, 'https://': self.proxy_url}
+                self._google_translator = Translator(**kwargs)
+            return self._google_translator
+    
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self.session is not None:
+            self.session.close()
+
+class TranslationCancelled(Exception):
+    """翻譯請求已被新請求取代（流式輸出中途停止），不計入服務失敗"""
+
+class TranslationServiceError(Exception):
+    """翻譯服務請求失敗（帶HTTP狀態碼及Retry-After，用於判斷是否重試）"""
+    
+    RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+    
+    def __init__(self, message: str, provider: str = None, status_code: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after  # 秒
+    
+    @classmethod
+    def from_response(cls, message: str, response, provider: str = None) -> 'TranslationServiceError':
+        return cls(f"{message}: {response.status_code}", provider, response.status_code,
+                   cls.parse_retry_after(response.headers.get('Retry-After')))
+    
+    @staticmethod
+    def parse_retry_after(value) -> Optional[float]:
+        """解析Retry-After（秒數或HTTP日期）"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in self.RETRYABLE_STATUS
+
+class RetryPolicy:
+    """重試策略 - 指數退避加隨機抖動，遵從Retry-After（advanced.retry_attempts / retry_delay）"""
+    
+    def __init__(self, attempts: int = 3, delay_ms: int = 1000, max_delay_ms: int = 8000):
+        self.attempts = max(1, int(attempts))  # 最多嘗試次數（含第一次）
+        self.delay = delay_ms / 1000.0
+        self.max_delay = max_delay_ms / 1000.0
+    
+    @classmethod
+    def from_config(cls, config: dict) -> 'RetryPolicy':
+        advanced = config.get('advanced', {})
+        return cls(advanced.get('retry_attempts', 3), advanced.get('retry_delay', 1000),
+                   advanced.get('retry_max_delay', 8000))
+    
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """限流、服務端錯誤、超時及連接錯誤可重試，其他錯誤直接轉到下一個服務"""
+        if isinstance(error, TranslationServiceError):
+            return error.retryable
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        return type(error).__module__.split('.')[0] == 'httpx' and 'Error' in type(error).__name__
+    
+    def backoff(self, attempt: int, error: Exception = None) -> Optional[float]:
+        """第attempt次失敗後的等待時間（秒），超過上限的Retry-After返回None（不再重試）"""
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        delay = min(self.max_delay, self.delay * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+class CircuitBreaker:
+    """熔斷器 - 提供商連續失敗後暫停使用，超時後放行一個探測請求（半開），成功即恢復"""
+    
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    status_path = None  # 設置後狀態改變時寫入此文件（供monitor_status.py讀取）
+    
+    def __init__(self, provider: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.provider = provider
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout  # 秒
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = ''
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_provider(cls, provider: str, config: dict = None) -> 'CircuitBreaker':
+        """獲取提供商共享的熔斷器（配置改變時更新閾值，保留狀態）"""
+        breaker_config = (config or {}).get('translation_service', {}).get('routing', {}).get('circuit_breaker', {})
+        threshold = breaker_config.get('failure_threshold', 5)
+        reset_timeout = breaker_config.get('reset_timeout_ms', 30000) / 1000.0
+        with cls._instances_lock:
+            breaker = cls._instances.get(provider)
+            if breaker is None:
+                breaker = cls(provider, threshold, reset_timeout)
+                cls._instances[provider] = breaker
+            elif config is not None:
+                breaker.failure_threshold, breaker.reset_timeout = max(1, threshold), reset_timeout
+            return breaker
+    
+    @classmethod
+    def snapshot(cls) -> Dict[str, Dict[str, Any]]:
+        """所有提供商的熔斷器狀態"""
+        with cls._instances_lock:
+            breakers = list(cls._instances.values())
+        return {breaker.provider: breaker.status() for breaker in breakers}
+    
+    @classmethod
+    def reset_all(cls):
+        with cls._instances_lock:
+            breakers = list(cls._instances.values())
+        for breaker in breakers:
+            breaker.reset()
+    
+    @classmethod
+    def write_status(cls):
+        """把熔斷器狀態原子地寫入status_path"""
+        if not cls.status_path:
+            return
+        try:
+            temp_path = cls.status_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'updated_at': time.time(), 'providers': cls.snapshot()}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, cls.status_path)
+        except OSError as e:
+            print(f"[WARNING] Failed to write service status: {e}")
+    
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+            return {'state': self.state, 'failures': self.failures, 'retry_in': retry_in,
+                    'last_error': self.last_error}
+    
+    def allow_request(self) -> bool:
+        """是否允許發送請求（熔斷超時後只放行一個探測請求）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+    
+    def is_open(self) -> bool:
+        """熔斷中且未到探測時間"""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+    
+    def record_success(self):
+        with self._lock:
+            changed = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+        if changed:
+            print(f"[INFO] Provider {self.provider} recovered")
+            self.write_status()
+    
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._probe_in_flight = False
+            opened = self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                       and self.failures >= self.failure_threshold)
+            if opened:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+        if opened:
+            print(f"[WARNING] Circuit opened for {self.provider} after {self.failures} failures: {error}")
+            self.write_status()
+    
+    def release_probe(self):
+        """放棄探測請求（請求被取消，不計入成敗），下一個請求可重新探測"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+        self.write_status()
+
+def percentile(samples: List[float], percent: float) -> Optional[float]:
+    """已排序樣本的百分位（最近秩），無樣本時返回None"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))]
+
+class ProviderMetrics:
+    """翻譯服務請求指標 - 記錄每次請求的延遲、字節數、字符數、成敗及緩存狀態，
+    按 (提供商, 語言對) 統計延遲百分位；近期窗口保存在內存中供自適應路由使用
+    """
+    
+    WINDOW = 100             # 每個 (提供商, 語言對) 保留的近期請求數
+    MIN_SAMPLES = 5          # 計算評分所需的最少請求數
+    ERROR_PENALTY = 4.0      # 錯誤率對評分的懲罰倍數
+    FLUSH_SIZE = 50          # 累積多少條記錄寫入一次數據庫
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, db_path: str = None, retention_days: int = 30):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self._recent = {}  # (提供商, 源語言, 目標語言) -> deque[(延遲秒, 是否成功)]
+        self._pending = []
+        self._lock = threading.Lock()
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")  # 監控工具讀取時不阻塞寫入
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS request_metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    provider TEXT NOT NULL,
+                    source_lang TEXT,
+                    target_lang TEXT,
+                    cache_status TEXT NOT NULL,
+                    success INTEGER NOT NULL,
+                    latency_ms REAL,
+                    request_bytes INTEGER,
+                    response_bytes INTEGER,
+                    chars INTEGER,
+                    segments INTEGER,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_request_metrics_pair
+                    ON request_metrics(provider, source_lang, target_lang, created_at);
             ''')
-            result = cursor.fetchall()
-        except sqlite3.OperationalError:
-            # 如果表不存在，返回默認語言列表
-            result = [
-                ('zh-TW', '繁體中文', '繁體中文'),
-                ('en', 'English', 'English'),
-                ('ja', '日本語', '日本語'),
-                ('ko', '한국어', '한국어'),
-                ('es', 'Español', 'Español'),
-                ('fr', 'Français', 'Français'),
-                ('de', 'Deutsch', 'Deutsch'),
-            ]
-        
-        conn.close()
+            self._conn.execute("DELETE FROM request_metrics WHERE created_at < ?",
+                               (time.time() - retention_days * 86400,))
+            self._conn.commit()
+    
+    @classmethod
+    def get(cls) -> 'ProviderMetrics':
+        """共享的指標記錄器（未配置數據庫時只保留內存中的近期窗口）"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    
+    @classmethod
+    def configure(cls, config: dict, db_path: str = None) -> 'ProviderMetrics':
+        """按metrics配置建立共享的指標記錄器（db_path覆蓋配置中的數據庫路徑）"""
+        metrics_config = config.get('metrics', {})
+        db_path = db_path or metrics_config.get('db_path', 'provider_metrics.db')
+        if not metrics_config.get('enabled', True):
+            db_path = None
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = cls(db_path, metrics_config.get('retention_days', 30))
+            return cls._instance
+    
+    def record(self, provider: str, source_lang: str, target_lang: str, latency: float, texts: List[str],
+               translations: List[str] = None, error: Exception = None, cache_status: str = 'api'):
+        """記錄一次請求（cache_status: api / cache / fuzzy）"""
+        success = error is None
+        with self._lock:
+            window = self._recent.setdefault((provider, source_lang, target_lang), deque(maxlen=self.WINDOW))
+            if cache_status == 'api':
+                window.append((latency, success))
+            if self._conn is None:
+                return
+            self._pending.append((
+                time.time(), provider, source_lang, target_lang, cache_status, int(success), latency * 1000,
+                sum(len(text.encode('utf-8')) for text in texts),
+                sum(len(text.encode('utf-8')) for text in translations or ()),
+                sum(len(text) for text in texts), len(texts), str(error) if error else None,
+            ))
+            if len(self._pending) >= self.FLUSH_SIZE:
+                self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self._pending or self._conn is None:
+            return
+        try:
+            self._conn.executemany('''
+                INSERT INTO request_metrics (created_at, provider, source_lang, target_lang, cache_status, success,
+                                             latency_ms, request_bytes, response_bytes, chars, segments, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', self._pending)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Failed to write provider metrics: {e}")
+        self._pending = []
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def score(self, provider: str, source_lang: str, target_lang: str) -> Optional[float]:
+        """近期評分（越低越好）：成功請求的p95延遲按錯誤率加權，樣本不足時返回None"""
+        with self._lock:
+            window = list(self._recent.get((provider, source_lang, target_lang), ()))
+        if len(window) < self.MIN_SAMPLES:
+            return None
+        latencies = sorted(latency for latency, success in window if success)
+        error_rate = 1 - len(latencies) / len(window)
+        if not latencies:
+            return float('inf')
+        return percentile(latencies, 95) * (1 + self.ERROR_PENALTY * error_rate)
+    
+    def latency_report(self, days: float = 7, provider: str = None) -> List[Dict[str, Any]]:
+        """按 (提供商, 語言對) 統計API請求的p50/p95/p99延遲（毫秒）、錯誤率及流量"""
+        if self._conn is None:
+            return []
+        with self._lock:
+            self._flush_locked()
+            sql = '''
+                SELECT provider, source_lang, target_lang, cache_status, success, latency_ms, request_bytes,
+                       response_bytes, chars
+                FROM request_metrics WHERE created_at >= ?
+            '''
+            params = [time.time() - days * 86400]
+            if provider:
+                sql += " AND provider = ?"
+                params.append(provider)
+            rows = self._conn.execute(sql, params).fetchall()
+        
+        groups = {}
+        for name, src, tgt, cache_status, success, latency_ms, request_bytes, response_bytes, chars in rows:
+            group = groups.setdefault((name, src, tgt), {
+                'provider': name, 'source_lang': src, 'target_lang': tgt, 'requests': 0, 'errors': 0,
+                'cache_hits': 0, 'request_bytes': 0, 'response_bytes': 0, 'chars': 0, 'latencies': []})
+            if cache_status != 'api':
+                group['cache_hits'] += 1
+                continue
+            group['requests'] += 1
+            group['request_bytes'] += request_bytes or 0
+            group['response_bytes'] += response_bytes or 0
+            group['chars'] += chars or 0
+            if success:
+                group['latencies'].append(latency_ms)
+            else:
+                group['errors'] += 1
+        
+        report = []
+        for group in groups.values():
+            latencies = sorted(group.pop('latencies'))
+            group['error_rate'] = group['errors'] / group['requests'] if group['requests'] else 0.0
+            for percent in (50, 95, 99):
+                group[f'p{percent}'] = percentile(latencies, percent)
+            report.append(group)
+        report.sort(key=lambda group: (group['source_lang'] or '', group['target_lang'] or '',
+                                       group['p50'] if group['p50'] is not None else float('inf')))
+        return report
+    
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class TranslationProvider(ABC):
+    """翻譯服務接口 - 適配器實現translate_chunk，批量請求按服務的條數及字符上限自動分組"""
+    
+    name = ''
+    config_key = None  # translation_service中的配置項（默認與name相同）
+    MAX_BATCH_SIZE = 50  # 單次請求最多條數
+    MAX_CHARS = 5000     # 單次請求最多字符數
+    LANGUAGE_CODES = {}  # 應用語言代碼 -> 服務語言代碼
+    
+    def __init__(self, config: dict):
+        self.config = config
+        self.settings = config.get('translation_service', {}).get(self.config_key or self.name, {})
+    
+    @staticmethod
+    def get_class(name: str):
+        return PROVIDER_CLASSES.get(name)
+    
+    @staticmethod
+    def create(name: str, config: dict) -> 'TranslationProvider':
+        provider_class = PROVIDER_CLASSES.get(name)
+        if provider_class is None:
+            raise TranslationServiceError(f"不支持的翻譯服務: {name}", name)
+        return provider_class(config)
+    
+    def is_configured(self) -> bool:
+        return bool(self.settings.get('enabled', False) and self.settings.get('api_key'))
+    
+    def language_code(self, lang: str) -> str:
+        return self.LANGUAGE_CODES.get(lang, lang)
+    
+    def supported_languages(self) -> List[str]:
+        return MultiServiceTranslator().get_supported_languages(self.name)
+    
+    def limits(self) -> Dict[str, int]:
+        return {'max_batch_size': self.MAX_BATCH_SIZE, 'max_chars': self.MAX_CHARS}
+    
+    def translate(self, text: str, source: str, target: str) -> str:
+        return self.translate_batch([text], source, target)[0]
+    
+    def translate_batch(self, texts: List[str], source: str, target: str) -> List[str]:
+        """批量翻譯，返回與輸入順序對應的譯文"""
+        results = []
+        for pack in TranslationEngine.pack_segments(texts, self.MAX_BATCH_SIZE, self.MAX_CHARS):
+            translations = self.translate_chunk(pack, source, target)
+            if len(translations) != len(pack):
+                raise TranslationServiceError(
+                    f"{self.name} 返回 {len(translations)} 條譯文，預期 {len(pack)} 條", self.name)
+            results.extend(translations)
+        return results
+    
+    @abstractmethod
+    def translate_chunk(self, texts: List[str], source: str, target: str) -> List[str]:
+        """一次請求翻譯一組文本（不超過服務限制）"""
+    
+    def detect(self, text: str) -> Optional[str]:
+        """檢測語言，服務不支持時返回None"""
+        return None
+    
+    def post(self, url: str, message: str, **kwargs):
+        """通過共享會話發送請求，非200時拋出TranslationServiceError，返回JSON"""
+        response = HttpSessionManager.get(self.config).post(url, **kwargs)
+        if response.status_code != 200:
+            raise TranslationServiceError.from_response(message, response, self.name)
+        return response.json()
+
+class GoogleProvider(TranslationProvider):
+    """Google翻譯（googletrans，未安裝時使用Cloud Translation v2 API）"""
+    
+    name = 'google'
+    config_key = 'google_api'
+    # googletrans對列表逐條發送請求，打包不減少請求數，且限流只按一次請求計算；
+    # 只有Cloud Translation API（googletrans未安裝時）能在一次請求中翻譯多條
+    MAX_BATCH_SIZE = 1 if importlib.util.find_spec('googletrans') else 128
+    MAX_CHARS = 5000
+    LANGUAGE_CODES = {'zh-TW': 'zh-tw', 'zh-CN': 'zh-cn', 'zh': 'zh-cn'}
+    API_LANGUAGE_CODES = {'zh-TW': 'zh'}  # Cloud Translation API的語言代碼
+    
+    def is_configured(self) -> bool:
+        return True
+    
+    def translate_chunk(self, texts, source, target):
+        try:
+            translator = HttpSessionManager.get(self.config).google_translator()
+            results = translator.translate(texts, dest=self.language_code(target))
+            return [result.text for result in results]
+        except ImportError:
+            # 如果googletrans未安裝，使用備用方案
+            return self.translate_with_api(texts, target)
+        except Exception as e:
+            if RetryPolicy.is_retryable(e):
+                raise  # 保留連接錯誤類型以便重試
+            raise Exception(f"Google翻譯錯誤: {str(e)}")
+    
+    def translate_with_api(self, texts: List[str], target: str) -> List[str]:
+        """直接調用Cloud Translation v2 API（多個q參數，一次請求）"""
+        api_key = self.settings.get('api_key', '')
+        if not api_key:
+            raise Exception("Google API密鑰未設置")
+        
+        params = [('key', api_key), ('target', self.API_LANGUAGE_CODES.get(target, target)), ('format', 'text')]
+        params += [('q', text) for text in texts]
+        result = self.post(self.settings.get('endpoint', ''), "API請求失敗", data=params)
+        translations = [item['translatedText'] for item in result['data']['translations']]
+        if len(translations) != len(texts):
+            raise Exception(f"API返回 {len(translations)} 條譯文，預期 {len(texts)} 條")
+        return translations
+    
+    def detect(self, text):
+        try:
+            return HttpSessionManager.get(self.config).google_translator().detect(text).lang
+        except Exception:
+            return None
+
+class LLMRequestBuilder:
+    """自定義LLM請求構建 - 模型參數取自config.json的api區塊（translation_service.custom_llm中的同名項優先），
+    max_tokens按輸入長度及目標語言的擴展比例估算，不超過設定的上限
+    
+    系統提示詞、術語表及示例組成穩定的前綴消息，相同配置下每次請求逐字節相同，
+    以便服務端的前綴緩存（OpenAI自動緩存、cache_control標記、llama.cpp的cache_prompt）復用
+    """
+    
+    DEFAULT_MODEL = "gpt-3.5-turbo"
+    DEFAULT_TEMPERATURE = 0.3
+    DEFAULT_MAX_TOKENS = 4096  # max_tokens上限
+    DEFAULT_MIN_TOKENS = 64
+    SEGMENT_OVERHEAD_TOKENS = 8  # 批量請求中每段[[編號]]標記及換行
+    SAFETY_MARGIN = 1.25
+    # 譯文token數與原文token數之比（按目標語言估算，可在配置的expansion_ratios中覆蓋）
+    EXPANSION_RATIOS = {
+        'zh-TW': 2.0, 'zh-CN': 1.8, 'zh': 1.8, 'ja': 2.0, 'ko': 2.0,
+        'en': 1.2, 'fr': 1.5, 'de': 1.5, 'es': 1.5, 'pt': 1.5, 'vi': 1.8,
+        'ru': 2.0, 'ar': 2.0, 'hi': 3.0, 'th': 3.0,
+    }
+    DEFAULT_EXPANSION_RATIO = 1.5
+    
+    TRANSLATE_INSTRUCTION = "請翻譯以下文字："
+    BATCH_INSTRUCTION = "請逐段翻譯以下文字。每段以[[編號]]開頭，請在譯文中保留相同的[[編號]]標記和順序，只輸出譯文：\n"
+    CONTEXT_TEMPLATE = "上文（僅供參考，不要翻譯）：{}\n\n"
+    # prompt_cache：auto 按api_url選擇；openai 依賴服務自動緩存（流式請求時要求返回用量）；
+    # cache_control 在前綴最後一條消息上標記cache_control（Anthropic兼容的網關）；llama.cpp 發送cache_prompt；none 不處理
+    PROMPT_CACHE_MODES = ('auto', 'openai', 'cache_control', 'llama.cpp', 'none')
+    
+    _prefix_cache = {}  # 配置 -> 前綴消息，所有請求共享同一份
+    _usage = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+    _lock = threading.Lock()
+    
+    def __init__(self, config: dict):
+        self.settings = config.get('translation_service', {}).get('custom_llm', {})
+        api_config = config.get('api', {})
+        
+        def setting(key, default):
+            return self.settings.get(key, api_config.get(key, default))
+        
+        self.model = setting('model', self.DEFAULT_MODEL)
+        self.temperature = setting('temperature', self.DEFAULT_TEMPERATURE)
+        self.max_tokens_limit = setting('max_tokens', self.DEFAULT_MAX_TOKENS)
+        self.min_tokens = min(setting('min_tokens', self.DEFAULT_MIN_TOKENS), self.max_tokens_limit)
+        self.expansion_ratios = dict(self.EXPANSION_RATIOS, **setting('expansion_ratios', {}))
+        self.glossary = setting('glossary', {})
+        self.examples = setting('examples', [])
+        self.prompt_cache = setting('prompt_cache', 'auto')
+        if self.prompt_cache not in self.PROMPT_CACHE_MODES:
+            print(f"[WARNING] Unknown prompt_cache mode {self.prompt_cache!r}, using 'auto'")
+            self.prompt_cache = 'auto'
+        if self.prompt_cache == 'auto':
+            api_url = self.settings.get('api_url', '').lower()
+            self.prompt_cache = 'cache_control' if 'anthropic' in api_url or 'openrouter' in api_url else 'openai'
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估算token數：中日韓等字符約每字一個token，其他文字約每4個字符一個token"""
+        wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+        return wide + (len(text) - wide + 3) // 4
+    
+    def max_tokens(self, texts: List[str], target_lang: str) -> int:
+        """按原文長度及目標語言估算回覆所需的max_tokens"""
+        ratio = self.expansion_ratios.get(target_lang, self.DEFAULT_EXPANSION_RATIO)
+        estimate = sum(self.estimate_tokens(text) for text in texts) * ratio * self.SAFETY_MARGIN
+        if len(texts) > 1:
+            estimate += self.SEGMENT_OVERHEAD_TOKENS * len(texts)
+        return int(min(self.max_tokens_limit, max(self.min_tokens, estimate)))
+    
+    def user_message(self, text: str, context: str = '') -> str:
+        """單條翻譯的用戶消息（context為只供參考的上文）"""
+        return (self.CONTEXT_TEMPLATE.format(context) if context else '') + self.TRANSLATE_INSTRUCTION + text
+    
+    def batch_message(self, texts: List[str], context: str = '') -> str:
+        """批量翻譯的用戶消息：編號分段"""
+        segments = '\n'.join(f"[[{i}]]\n{text}" for i, text in enumerate(texts, 1))
+        return (self.CONTEXT_TEMPLATE.format(context) if context else '') + self.BATCH_INSTRUCTION + segments
+    
+    def prefix_messages(self) -> List[Dict[str, Any]]:
+        """穩定的前綴消息：系統提示詞（含按原文排序的術語表）及示例對話，同一配置只構建一次"""
+        key = json.dumps([self.settings.get('system_prompt', ''), self.glossary, self.examples, self.prompt_cache],
+                         ensure_ascii=False, sort_keys=True)
+        with self._lock:
+            messages = self._prefix_cache.get(key)
+        if messages is not None:
+            return messages
+        
+        system_prompt = self.settings.get('system_prompt', '')
+        if self.glossary:
+            system_prompt += "\n\n術語表（請按此翻譯）：\n" + '\n'.join(
+                f"- {source} => {target}" for source, target in sorted(self.glossary.items()))
+        messages = [{"role": "system", "content": system_prompt}]
+        for example in self.examples:
+            messages.append({"role": "user", "content": self.user_message(example['source'])})
+            messages.append({"role": "assistant", "content": example['translation']})
+        if self.prompt_cache == 'cache_control':
+            last = messages[-1]
+            messages[-1] = {"role": last['role'], "content": [
+                {"type": "text", "text": last['content'], "cache_control": {"type": "ephemeral"}}]}
+        
+        with self._lock:
+            return self._prefix_cache.setdefault(key, messages)
+    
+    @staticmethod
+    def parse_usage(result: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """從回覆讀取 (提示token數, 命中前綴緩存的token數)，沒有用量信息時返回None
+        
+        兼容OpenAI的prompt_tokens_details.cached_tokens、Anthropic的cache_read_input_tokens及llama.cpp的timings.cache_n
+        """
+        usage = result.get('usage') or {}
+        timings = result.get('timings') or {}
+        if 'cache_n' in timings:
+            return timings['cache_n'] + timings.get('prompt_n', 0), timings['cache_n']
+        if not usage:
+            return None
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        if 'prompt_tokens' in usage:
+            return usage['prompt_tokens'], cached or usage.get('cache_read_input_tokens') or 0
+        cache_read = usage.get('cache_read_input_tokens') or 0
+        return (usage.get('input_tokens', 0) + cache_read + (usage.get('cache_creation_input_tokens') or 0),
+                cache_read)
+    
+    @classmethod
+    def record_usage(cls, result: Dict[str, Any]):
+        """累計回覆中的提示token數及緩存命中數"""
+        usage = cls.parse_usage(result)
+        if usage is None:
+            return
+        prompt_tokens, cached_tokens = usage
+        with cls._lock:
+            cls._usage['requests'] += 1
+            cls._usage['prompt_tokens'] += prompt_tokens
+            cls._usage['cached_tokens'] += cached_tokens
+        print(f"[DEBUG] LLM prompt tokens: {prompt_tokens}, cached: {cached_tokens}")
+    
+    @classmethod
+    def get_usage_stats(cls) -> Dict[str, Any]:
+        """前綴緩存統計，cached_ratio為命中緩存的提示token比例"""
+        with cls._lock:
+            stats = dict(cls._usage)
+        stats['cached_ratio'] = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        return stats
+    
+    def build(self, user_content: str, max_tokens: int = None,
+              stream: bool = False) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+        """構建請求，返回 (api_url, 請求數據, headers)"""
+        if not self.settings.get('enabled', False):
+            raise Exception("自定義LLM未啟用")
+        
+        api_url = self.settings.get('api_url', '')
+        if not api_url:
+            raise Exception("LLM API URL未設置")
+        
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        api_key = self.settings.get('api_key', '')
+        if api_key:
+            headers['Authorization'] = f'Bearer {api_key}'
+        
+        # 構建請求數據（適用於OpenAI格式的API），穩定的前綴在前，每次不同的內容在最後
+        data = {
+            "model": self.model,
+            "messages": self.prefix_messages() + [
+                {"role": "user", "content": user_content}
+            ],
+            "max_tokens": max_tokens or self.max_tokens_limit,
+            "temperature": self.temperature
+        }
+        if self.prompt_cache == 'llama.cpp':
+            data['cache_prompt'] = True
+        if stream:
+            data['stream'] = True
+            if self.prompt_cache == 'openai':
+                data['stream_options'] = {'include_usage': True}
+        return api_url, data, headers
+
+class TextSegmenter:
+    """長文本分段 - 按段落及句子邊界（支持中日韓標點）把文本分成不超過預算的塊，
+    預算按token估算（LLM）或字符數（機器翻譯服務）計算，超長的句子再按詞或字拆分
+    """
+    
+    # 常見縮寫及單個大寫字母（姓名縮寫）後的句點不是句末
+    ABBREVIATIONS = ('Mr', 'Mrs', 'Ms', 'Dr', 'Prof', 'Sr', 'Jr', 'St', 'vs', 'cf', 'Fig', 'e.g', 'i.e')
+    ABBREVIATION_GUARD = ''.join(rf'(?<!\b{re.escape(word)})' for word in ABBREVIATIONS) + r'(?<!\b[A-Z])'
+    # 句子：到句末標點（含其後的引號括號）或行尾為止，連同其後的空白
+    SENTENCE_PATTERN = re.compile(
+        r'(?P<body>[^\n]*?(?:[。！？；…]+[」』”’）)]*|(?:[!?;]|' + ABBREVIATION_GUARD + r'\.)[.!?;]*[\'"”’)\]]*(?=\s|$)'
+        r'|(?=\n)|$))(?P<space>\s*)')
+    WORD_PATTERN = re.compile(r'[\u2E80-\uFFFF]|[^\s\u2E80-\uFFFF]+\s*|\s+')
+    
+    def __init__(self, max_tokens: int = None, max_chars: int = None):
+        self.budget = max_tokens or max_chars
+        self.size = LLMRequestBuilder.estimate_tokens if max_tokens else len
+    
+    @classmethod
+    def split_sentences(cls, text: str) -> List[Tuple[str, str]]:
+        """拆分為 (句子, 其後的空白) 列表，依次連接後與原文相同（不含開頭的空白）"""
+        sentences = []
+        for match in cls.SENTENCE_PATTERN.finditer(text.lstrip()):
+            if match.group('body') or match.group('space'):
+                sentences.append((match.group('body'), match.group('space')))
+        return sentences
+    
+    def split_long_sentence(self, sentence: str) -> List[str]:
+        """按詞（中日韓按字）把超過預算的句子拆開，依次連接後與原句相同"""
+        if self.size(sentence) <= self.budget:
+            return [sentence]
+        parts, current = [], ''
+        for word in self.WORD_PATTERN.findall(sentence):
+            if current and self.size(current + word) > self.budget:
+                parts.append(current)
+                current = ''
+            current += word
+        if current:
+            parts.append(current)
+        return parts
+    
+    def segments(self, text: str) -> List[Tuple[str, str]]:
+        """拆分為句子級的段 (段, 其後的空白)，超過預算的句子再拆開"""
+        segments = []
+        for sentence, space in self.split_sentences(text):
+            parts = self.split_long_sentence(sentence)
+            segments += [self.make_chunk(part, '') for part in parts[:-1]]
+            segments.append(self.make_chunk(parts[-1], space))
+        return segments
+    
+    def pack(self, segments: List[Tuple[str, str]], max_count: int = None) -> List[List[int]]:
+        """把相鄰的段按預算分組，返回各組的序號；已超過預算一半時遇到段落結尾即分組"""
+        groups = []
+        current, current_text = [], ''
+        for i, (segment, _) in enumerate(segments):
+            if current:
+                previous_separator = segments[current[-1]][1]
+                candidate = current_text + previous_separator + segment
+                if (self.size(candidate) > self.budget
+                        or ('\n' in previous_separator and self.size(current_text) * 2 >= self.budget)
+                        or (max_count and len(current) >= max_count)):
+                    groups.append(current)
+                    current, candidate = [], segment
+            else:
+                candidate = segment
+            current.append(i)
+            current_text = candidate
+        if current:
+            groups.append(current)
+        return groups
+    
+    def split(self, text: str) -> List[Tuple[str, str]]:
+        """分成不超過預算的 (塊, 其後的空白) 列表"""
+        segments = self.segments(text)
+        chunks = []
+        for group in self.pack(segments):
+            body = ''.join(segment + separator for segment, separator in (segments[i] for i in group[:-1]))
+            chunks.append((body + segments[group[-1]][0], segments[group[-1]][1]))
+        return chunks
+    
+    @staticmethod
+    def make_chunk(text: str, separator: str) -> Tuple[str, str]:
+        """塊末尾的空白歸入分隔符（翻譯服務不保留首尾空白）"""
+        body = text.rstrip()
+        return body, text[len(body):] + separator
+    
+    @staticmethod
+    def join(chunks: List[Tuple[str, str]], translations: List[str], target_lang: str = None) -> str:
+        """按原來的分隔空白（保留換行和段落）拼接各塊的譯文
+        
+        指定目標語言時，行內的分隔按目標語言調整：中文及日文句子之間不加空格，其他語言以空格分隔
+        """
+        joined = ''
+        for translation, (_, separator) in zip(translations, chunks):
+            if target_lang and '\n' not in separator:
+                separator = '' if target_lang.split('-')[0] in ('zh', 'ja') else ' '
+            joined += translation + separator
+        return joined.rstrip()
+
+class CustomLLMProvider(TranslationProvider):
+    """自定義LLM（OpenAI格式的API）
+    
+    on_partial: 可選的回調on_partial(各條已生成的譯文列表，尚未開始的為None)，設置時以SSE流式請求
+    is_cancelled: 可選的回調，流式輸出中返回True時斷開連接並拋出TranslationCancelled
+    """
+    
+    name = 'custom_llm'
+    MAX_BATCH_SIZE = 50
+    MAX_CHARS = 4000
+    SEGMENT_MARKER = re.compile(r'\[\[(\d+)\]\]')
+    PARTIAL_MARKER = re.compile(r'\[(\[\d*\]?)?$')  # 流式輸出中尚未完整的編號標記
+    STREAM_UPDATE_INTERVAL = 0.05  # 流式輸出時回調部分譯文的最短間隔（秒）
+    
+    def __init__(self, config: dict, on_partial=None, is_cancelled=None):
+        super().__init__(config)
+        self.builder = LLMRequestBuilder(config)
+        self.on_partial = on_partial
+        self.is_cancelled = is_cancelled
+    
+    def is_configured(self) -> bool:
+        return bool(self.settings.get('enabled', False) and self.settings.get('api_url'))
+    
+    def supported_languages(self):
+        return ['auto']  # 取決於模型
+    
+    def translate_chunk(self, texts, source, target, context: str = ''):
+        """context: 分塊翻譯時的前文（只供模型參考，不翻譯）"""
+        if len(texts) == 1:
+            return [self.translate_text(texts[0], target, context)]
+        return self.translate_numbered(texts, target, context)
+    
+    def translate_text(self, text: str, target: str, context: str = '') -> str:
+        """翻譯單條文本（設置了on_partial時流式請求）"""
+        max_tokens = self.builder.max_tokens([text], target)
+        user_content = self.builder.user_message(text, context)
+        if self.on_partial:
+            return self.stream(user_content, max_tokens, lambda reply: self.on_partial([reply]))
+        return self.request(user_content, max_tokens)
+    
+    def translate_numbered(self, texts: List[str], target: str, context: str = '') -> List[str]:
+        """批量翻譯：編號分段發送，按編號拆分回各行（流式輸出時逐步回調已生成的各條譯文）"""
+        user_content = self.builder.batch_message(texts, context)
+        max_tokens = self.builder.max_tokens(texts, target)
+        if self.on_partial:
+            content = self.stream(user_content, max_tokens, lambda reply: self.on_partial(
+                [self.split_numbered(self.PARTIAL_MARKER.sub('', reply)).get(i) for i in range(1, len(texts) + 1)]))
+        else:
+            content = self.request(user_content, max_tokens)
+        
+        translations = self.split_numbered(content)
+        if sorted(translations) != list(range(1, len(texts) + 1)) or not all(translations.values()):
+            # 模型沒有保留編號時逐條翻譯（不再流式輸出），保證每行對應正確
+            print(f"[WARNING] LLM batch response has mismatched segments, translating {len(texts)} lines individually")
+            return [self.request(self.builder.user_message(text, context), self.builder.max_tokens([text], target))
+                    for text in texts]
+        return [translations[i] for i in range(1, len(texts) + 1)]
+    
+    def split_numbered(self, content: str) -> Dict[int, str]:
+        """按[[編號]]標記拆分回覆，返回 編號 -> 譯文"""
+        parts = self.SEGMENT_MARKER.split(content)
+        return {int(number): translation.strip() for number, translation in zip(parts[1::2], parts[2::2])}
+    
+    def request(self, user_content: str, max_tokens: int = None) -> str:
+        """發送一次請求，返回回覆內容（max_tokens默認為設定的上限）"""
+        api_url, data, headers = self.builder.build(user_content, max_tokens)
+        response = HttpSessionManager.get(self.config).post(api_url, json=data, headers=headers)
+        
+        if response.status_code == 200:
+            result = response.json()
+            LLMRequestBuilder.record_usage(result)
+            if result['choices'][0].get('finish_reason') == 'length':
+                print(f"[WARNING] LLM reply truncated at max_tokens={data['max_tokens']}")
+            return result['choices'][0]['message']['content'].strip()
+        else:
+            raise TranslationServiceError.from_response("LLM API請求失敗", response, self.name)
+    
+    def stream(self, user_content: str, max_tokens: int, on_reply) -> str:
+        """以SSE流式請求，接收過程中把已生成的回覆傳給on_reply，返回完整回覆
+        
+        請求被取消時斷開連接並拋出TranslationCancelled；服務忽略stream參數時按普通回覆解析
+        """
+        api_url, data, headers = self.builder.build(user_content, max_tokens, stream=True)
+        
+        parts = []
+        usage = None
+        other_lines = []
+        start = last_update = time.monotonic()
+        with HttpSessionManager.get(self.config).stream(api_url, json=data, headers=headers) as response:
+            if response.status_code != 200:
+                raise TranslationServiceError.from_response("LLM API請求失敗", response, self.name)
+            
+            for line in HttpSessionManager.iter_lines(response):
+                if self.is_cancelled and self.is_cancelled():
+                    raise TranslationCancelled("翻譯請求已被新請求取代")
+                if not line.strip() or line.startswith(':'):
+                    continue  # 事件分隔的空行及保活注釋
+                if not line.startswith('data:'):
+                    other_lines.append(line)
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+                if chunk.get('usage') or chunk.get('timings'):
+                    usage = chunk  # 用量在最後的片段中返回
+                choices = chunk.get('choices') or [{}]
+                content = (choices[0].get('delta') or {}).get('content')
+                if not content:
+                    continue
+                if not parts:
+                    print(f"[DEBUG] First LLM token after {(time.monotonic() - start) * 1000:.0f}ms")
+                parts.append(content)
+                if time.monotonic() - last_update >= self.STREAM_UPDATE_INTERVAL:
+                    last_update = time.monotonic()
+                    on_reply(''.join(parts).strip())
+        
+        if not parts and other_lines:
+            result = json.loads('\n'.join(other_lines))
+            LLMRequestBuilder.record_usage(result)
+            return result['choices'][0]['message']['content'].strip()
+        if usage:
+            LLMRequestBuilder.record_usage(usage)
+        return ''.join(parts).strip()
+
+class DeepLProvider(TranslationProvider):
+    """DeepL API v2（單次請求最多50條）"""
+    
+    name = 'deepl'
+    MAX_BATCH_SIZE = 50
+    MAX_CHARS = 30000
+    LANGUAGE_CODES = {'zh-TW': 'ZH-HANT', 'zh-CN': 'ZH-HANS', 'zh': 'ZH-HANS', 'en': 'EN-US', 'pt': 'PT-PT'}
+    
+    def language_code(self, lang):
+        return self.LANGUAGE_CODES.get(lang, lang).upper()
+    
+    def headers(self):
+        return {'Authorization': f"DeepL-Auth-Key {self.settings.get('api_key', '')}"}
+    
+    def translate_chunk(self, texts, source, target):
+        data = [('target_lang', self.language_code(target))] + [('text', text) for text in texts]
+        if source and source != 'auto':
+            data.append(('source_lang', source.split('-')[0].upper()))  # 源語言不區分變體
+        result = self.post(self.settings['endpoint'], "DeepL請求失敗", data=data, headers=self.headers())
+        return [item['text'] for item in result['translations']]
+    
+    def detect(self, text):
+        result = self.post(self.settings['endpoint'], "DeepL請求失敗",
+                           data=[('target_lang', 'EN-US'), ('text', text)], headers=self.headers())
+        return result['translations'][0]['detected_source_language'].lower()
+
+class MicrosoftProvider(TranslationProvider):
+    """Microsoft Translator v3（單次請求最多1000條、50000字符）"""
+    
+    name = 'microsoft'
+    MAX_BATCH_SIZE = 1000
+    MAX_CHARS = 50000
+    LANGUAGE_CODES = {'zh-TW': 'zh-Hant', 'zh-CN': 'zh-Hans', 'zh': 'zh-Hans'}
+    
+    def headers(self):
+        headers = {'Ocp-Apim-Subscription-Key': self.settings.get('api_key', '')}
+        if self.settings.get('region'):
+            headers['Ocp-Apim-Subscription-Region'] = self.settings['region']
+        return headers
+    
+    def translate_chunk(self, texts, source, target):
+        params = {'api-version': '3.0', 'to': self.language_code(target)}
+        if source and source != 'auto':
+            params['from'] = self.language_code(source)
+        result = self.post(self.settings['endpoint'].rstrip('/') + '/translate', "Microsoft翻譯請求失敗",
+                           params=params, json=[{'Text': text} for text in texts], headers=self.headers())
+        return [item['translations'][0]['text'] for item in result]
+    
+    def detect(self, text):
+        result = self.post(self.settings['endpoint'].rstrip('/') + '/detect', "Microsoft翻譯請求失敗",
+                           params={'api-version': '3.0'}, json=[{'Text': text}], headers=self.headers())
+        return result[0]['language']
+
+class YandexProvider(TranslationProvider):
+    """Yandex Translate API v1.5（多個text參數一次請求）"""
+    
+    name = 'yandex'
+    MAX_BATCH_SIZE = 100
+    MAX_CHARS = 10000
+    LANGUAGE_CODES = {'zh-TW': 'zh', 'zh-CN': 'zh'}
+    
+    def translate_chunk(self, texts, source, target):
+        lang = self.language_code(target)
+        if source and source != 'auto':
+            lang = f"{self.language_code(source)}-{lang}"
+        data = [('key', self.settings.get('api_key', '')), ('lang', lang), ('format', 'plain')]
+        data += [('text', text) for text in texts]
+        result = self.post(self.settings['endpoint'].rstrip('/') + '/translate', "Yandex翻譯請求失敗", data=data)
+        return result['text']
+    
+    def detect(self, text):
+        result = self.post(self.settings['endpoint'].rstrip('/') + '/detect', "Yandex翻譯請求失敗",
+                           data={'key': self.settings.get('api_key', ''), 'text': text})
+        return result.get('lang')
+
+class BaiduProvider(TranslationProvider):
+    """百度翻譯（多行文本以換行分隔一次請求，單次不超過6000字節）"""
+    
+    name = 'baidu'
+    MAX_BATCH_SIZE = 100
+    MAX_CHARS = 2000
+    LANGUAGE_CODES = {'zh-TW': 'cht', 'zh-CN': 'zh', 'ja': 'jp', 'ko': 'kor', 'fr': 'fra', 'es': 'spa',
+                      'ar': 'ara', 'vi': 'vie', 'bg': 'bul', 'et': 'est', 'da': 'dan', 'fi': 'fin',
+                      'ro': 'rom', 'sl': 'slo', 'sv': 'swe'}
+    # 頻率限制及服務端錯誤映射為可重試的狀態碼
+    ERROR_STATUS = {'54003': 429, '54005': 429, '52001': 504, '52002': 503}
+    
+    def is_configured(self) -> bool:
+        return bool(self.settings.get('enabled', False) and self.settings.get('app_id')
+                    and self.settings.get('secret_key'))
+    
+    def request(self, query: str, source: str, target: str) -> Dict[str, Any]:
+        app_id = self.settings.get('app_id', '')
+        salt = str(random.randint(32768, 65536))
+        sign = hashlib.md5(f"{app_id}{query}{salt}{self.settings.get('secret_key', '')}".encode('utf-8')).hexdigest()
+        result = self.post(self.settings['endpoint'], "百度翻譯請求失敗", data={
+            'q': query, 'from': self.language_code(source or 'auto'), 'to': self.language_code(target),
+            'appid': app_id, 'salt': salt, 'sign': sign,
+        })
+        if 'error_code' in result and str(result['error_code']) != '52000':
+            code = str(result['error_code'])
+            raise TranslationServiceError(f"百度翻譯錯誤 {code}: {result.get('error_msg', '')}", self.name,
+                                          self.ERROR_STATUS.get(code))
         return result
     
-    def save_multilingual_content(self, content_id: str, language: str, content: str, title: str = None):
-        """保存多語言內容"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO multilingual_content 
-            (content_id, language, content, title, updated_at) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (content_id, language, content, title, datetime.now().isoformat()))
+    def translate_chunk(self, texts, source, target):
+        if any('\n' in text for text in texts):
+            # 換行用於分隔各條文本，多行文本單獨請求
+            return ['\n'.join(item['dst'] for item in self.request(text, source, target)['trans_result'])
+                    for text in texts]
+        return [item['dst'] for item in self.request('\n'.join(texts), source, target)['trans_result']]
+    
+    def detect(self, text):
+        return self.request(text, 'auto', 'en').get('from')
+
+PROVIDER_CLASSES = {provider.name: provider for provider in (
+    GoogleProvider, CustomLLMProvider, DeepLProvider, MicrosoftProvider, YandexProvider, BaiduProvider)}
+
+class TranslationRouter:
+    """翻譯路由 - 按services_order依次嘗試可用的翻譯服務
+    
+    服務出錯或超時時轉到下一個服務；啟用對沖時，首選服務超過近期延遲百分位仍未返回，
+    同時向下一個服務發出請求，採用最先成功的結果。每個服務的請求按RetryPolicy重試，
+    熔斷中的服務直接跳過。
+    """
+    
+    DEFAULT_ROUTING = {
+        'failover': True,
+        'hedging': True,
+        'hedge_percentile': 95,          # 對沖等待時間取首選服務近期延遲的百分位
+        'hedge_min_delay_ms': 300,
+        'hedge_default_delay_ms': 2000,  # 延遲樣本不足時的等待時間
+        'attempt_timeout_ms': 8000,      # 超過此時間未返回即轉到下一個服務
+        'mode': 'ordered',               # ordered 按services_order；adaptive 按各語言對的近期延遲及錯誤率排序
+    }
+    MIN_LATENCY_SAMPLES = 5
+    
+    _latencies = {}  # 提供商 -> 近期成功請求的延遲（秒），所有路由共享
+    _latencies_lock = threading.Lock()
+    _executor = None
+    _executor_lock = threading.Lock()
+    
+    def __init__(self, config: dict, translate_fn):
+        """translate_fn(provider, texts, **options) -> 譯文列表
+        
+        options只在調用方指定時傳入：context（LLM參考的前文）、on_partial（流式輸出的部分譯文回調）、
+        request（發起翻譯的TranslationRequest）
+        """
+        self.config = config
+        self.translate_fn = translate_fn
+        service_config = config.get('translation_service', {})
+        self.routing = dict(self.DEFAULT_ROUTING, **service_config.get('routing', {}))
+        self.retry_policy = RetryPolicy.from_config(config)
+    
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """共享的請求線程池（被放棄的慢請求在後台結束，不阻塞調用方）"""
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="TranslationRouter")
+            return cls._executor
+    
+    @classmethod
+    def record_latency(cls, provider: str, seconds: float):
+        with cls._latencies_lock:
+            cls._latencies.setdefault(provider, deque(maxlen=50)).append(seconds)
+    
+    @classmethod
+    def latency_percentile(cls, provider: str, percent: float) -> Optional[float]:
+        """提供商近期延遲的百分位（秒），樣本不足時返回None"""
+        with cls._latencies_lock:
+            samples = sorted(cls._latencies.get(provider, ()))
+        if len(samples) < cls.MIN_LATENCY_SAMPLES:
+            return None
+        return percentile(samples, percent)
+    
+    def is_available(self, provider: str) -> bool:
+        """提供商是否已實現並已配置"""
+        provider_class = TranslationProvider.get_class(provider)
+        return provider_class is not None and provider_class(self.config).is_configured()
+    
+    def provider_chain(self, source_lang: str = None, target_lang: str = None) -> List[str]:
+        """按首選服務及services_order排列的可用服務，排除disabled_services、未啟用及熔斷中的服務
+        
+        自適應模式下按語言對的近期評分重新排序
+        """
+        service_config = self.config.get('translation_service', {})
+        primary = service_config.get('provider', 'google')
+        if not self.routing['failover']:
+            return [primary]
+        
+        active = service_config.get('active_services', [])
+        disabled = service_config.get('disabled_services', [])
+        chain = []
+        for provider in [primary] + service_config.get('services_order', []):
+            if provider in chain or provider in disabled:
+                continue
+            if provider != primary and active and provider not in active:
+                continue
+            if provider == primary or self.is_available(provider):
+                chain.append(provider)
+        if self.routing['mode'] == 'adaptive':
+            chain = MultiServiceTranslator.adaptive_order(chain, source_lang, target_lang)
+        return [provider for provider in chain if not CircuitBreaker.for_provider(provider, self.config).is_open()]
+    
+    def hedge_delay(self, provider: str) -> float:
+        """對沖前等待首選服務的時間（秒）"""
+        latency = self.latency_percentile(provider, self.routing['hedge_percentile'])
+        if latency is None:
+            return self.routing['hedge_default_delay_ms'] / 1000.0
+        return max(latency, self.routing['hedge_min_delay_ms'] / 1000.0)
+    
+    def _attempt(self, provider, texts, acquire, source_lang, target_lang, options):
+        """向一個服務請求翻譯，可重試的錯誤按退避時間重試
+        
+        重試用盡或遇到不可重試的錯誤時才向熔斷器記錄一次失敗（重試屬於同一個請求）
+        """
+        breaker = CircuitBreaker.for_provider(provider, self.config)
+        metrics = ProviderMetrics.get()
+        for attempt in range(1, self.retry_policy.attempts + 1):
+            # 只有第一次嘗試申請放行（半開時探測名額由本請求持有直到重試結束），
+            # 重試前其他請求已觸發熔斷時放棄
+            allowed = breaker.allow_request() if attempt == 1 else not breaker.is_open()
+            if not allowed:
+                raise TranslationServiceError(f"{provider} 暫時不可用（熔斷中）", provider)
+            if acquire:
+                acquire(provider)
+            start = time.monotonic()
+            try:
+                translations = self.translate_fn(provider, texts, **options)
+                if len(translations) != len(texts) or not all(translations):
+                    raise Exception("翻譯結果為空")
+            except TranslationCancelled:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                metrics.record(provider, source_lang, target_lang, time.monotonic() - start, texts, error=e)
+                delay = self.retry_policy.backoff(attempt, e) if self.retry_policy.is_retryable(e) else None
+                if attempt == self.retry_policy.attempts or delay is None:
+                    breaker.record_failure(e)
+                    raise
+                print(f"[WARNING] {provider} request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            latency = time.monotonic() - start
+            breaker.record_success()
+            self.record_latency(provider, latency)
+            metrics.record(provider, source_lang, target_lang, latency, texts, translations)
+            return translations
+    
+    def translate(self, texts: List[str], hedge: bool = True, acquire=None,
+                  source_lang: str = None, target_lang: str = None,
+                  on_partial=None, context: str = '', request=None) -> Tuple[List[str], str]:
+        """翻譯文本，返回 (譯文列表, 實際使用的提供商)
+        
+        hedge: 是否允許對沖請求（批量翻譯時關閉，避免重複計費）
+        on_partial: 流式輸出的部分譯文回調（傳給translate_fn）；設置時首選服務不對沖也不因耗時轉移，
+                    只在出錯時轉到下一個服務（等待首個token的時間由HTTP讀取超時限制）
+        acquire: acquire(provider) 在每次請求前調用（用於限流）
+        source_lang/target_lang: 語言對（用於記錄指標及自適應路由）
+        context: 分塊翻譯時的前文，以context選項傳給translate_fn（只供LLM參考，不翻譯）
+        request: 發起翻譯的請求，以request選項傳給translate_fn（提供語言對及過期狀態）
+        """
+        streaming = on_partial is not None
+        options = {}
+        if context:
+            options['context'] = context
+        if streaming:
+            options['on_partial'] = on_partial
+        if request is not None:
+            options['request'] = request
+        remaining = self.provider_chain(source_lang, target_lang)
+        if not remaining:
+            raise TranslationServiceError("沒有可用的翻譯服務（均已禁用或熔斷中）")
+        
+        executor = self.get_executor()
+        in_flight = {}
+        errors = []
+        
+        def launch():
+            provider = remaining.pop(0)
+            in_flight[executor.submit(self._attempt, provider, texts, acquire, source_lang, target_lang,
+                                      options)] = provider
+            return provider
+        
+        def attempt_deadline():
+            return None if streaming else time.monotonic() + self.routing['attempt_timeout_ms'] / 1000.0
+        
+        primary = launch()
+        if hedge and self.routing['hedging'] and not streaming:
+            next_launch = time.monotonic() + self.hedge_delay(primary)
+        else:
+            next_launch = attempt_deadline()
         
-        conn.commit()
-        conn.close()
+        while in_flight:
+            timeout = max(0.0, next_launch - time.monotonic()) if remaining and next_launch is not None else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            failed = False
+            for future in done:
+                provider = in_flight.pop(future)
+                try:
+                    translations = future.result()
+                except TranslationCancelled:
+                    raise
+                except Exception as e:
+                    print(f"[WARNING] Provider {provider} failed: {e}")
+                    errors.append(f"{provider}: {e}")
+                    failed = True
+                    continue
+                if provider != primary:
+                    print(f"[INFO] Translation served by fallback provider {provider}")
+                return translations, provider
+            
+            if remaining and (failed or (next_launch is not None and time.monotonic() >= next_launch)):
+                if not failed:
+                    print(f"[INFO] Provider {in_flight[next(iter(in_flight))]} is slow, "
+                          f"also requesting {remaining[0]}")
+                launch()
+                next_launch = attempt_deadline()
+        
+        raise TranslationServiceError("所有翻譯服務均失敗: " + "; ".join(errors))
 
 class LanguageDetector:
     """語言檢測器"""
@@ -800,226 +3244,682 @@ class LanguageDetector:
         
         return 'auto'
 
-class TranslationWorker(QThread):
-    """翻譯工作線程 - 增強版支持記憶庫和語言檢測"""
-    translation_complete = pyqtSignal(str)
-    translation_error = pyqtSignal(str)
+class TranslationRequest:
+    """一次翻譯請求的狀態 - 原文、語言對及調用方的回調，由TranslationEngine處理
     
-    def __init__(self, text, config, memory=None, source_lang='auto', target_lang=None):
-        super().__init__()
+    is_stale: 可選的回調，返回True時表示請求已過期，不再調用翻譯服務
+    on_partial: 可選的回調on_partial(已生成的譯文)，自定義LLM流式輸出或分組翻譯時逐步調用
+    """
+    
+    def __init__(self, text: str, source_lang: str, target_lang: str, is_stale=None, on_partial=None):
         self.text = text
-        self.config = config
-        self.memory = memory
         self.source_lang = source_lang
-        self.target_lang = target_lang or config.get('translation', {}).get('default_target', 'zh-TW')
-        self.detector = LanguageDetector()  # 初始化語言檢測器
+        self.target_lang = target_lang
+        self.is_stale = is_stale
+        self.on_partial = on_partial
+        self.flight_key = None
+        self.fuzzy_match = None  # 使用近似匹配時為 (記憶庫中的原文, 相似度)
+
+class TranslationEngine:
+    """翻譯引擎 - 記憶庫查詢、路由調用翻譯服務及保存，由流水線及批量翻譯各持有一個
     
-    def run(self):
-        try:
-            print(f"[DEBUG] TranslationWorker started for text: {self.text[:30]}...")
-            
-            # 自動檢測語言
-            if self.source_lang == 'auto':
-                try:
-                    self.source_lang = self.detector.detect_language(self.text)
-                    if self.source_lang == 'auto':
-                        self.source_lang = 'en'  # 默認為英語
-                except Exception as e:
-                    print(f"[WARNING] Language detection failed: {e}, using 'en'")
-                    self.source_lang = 'en'
-            
-            print(f"[DEBUG] Detected language: {self.source_lang} -> {self.target_lang}")
-            
-            # 檢查翻譯記憶庫
-            if self.memory:
-                try:
-                    cached = self.memory.get_translation(self.text, self.source_lang, self.target_lang)
-                    if cached:
-                        print(f"[DEBUG] Using cached translation")
-                        self.translation_complete.emit(cached)
-                        return
-                except Exception as e:
-                    print(f"[WARNING] Memory lookup failed: {e}")
-            
-            print(f"[DEBUG] Starting translation...")
-            result = self.translate_text(self.text)
-            print(f"[DEBUG] Translation result: {result[:50] if result else 'None'}...")
-            
-            if not result:
-                raise Exception("翻譯結果為空")
-            
-            # 保存到記憶庫
-            if self.memory and result:
-                try:
-                    provider = self.config.get('translation_service', {}).get('provider', 'google')
-                    self.memory.save_translation(self.text, result, self.source_lang, self.target_lang, provider)
-                    print(f"[DEBUG] Saved to memory")
-                except Exception as e:
-                    print(f"[WARNING] Memory save failed: {e}")
-            
-            self.translation_complete.emit(result)
-            print(f"[DEBUG] Translation complete signal emitted")
-            
-        except Exception as e:
-            error_msg = f"翻譯失敗: {str(e)}"
-            print(f"[ERROR] {error_msg}")
-            self.translation_error.emit(error_msg)
+    請求相關的狀態放在TranslationRequest中並顯式傳入，同一引擎可在多個線程中同時處理不同請求
+    """
     
-    def translate_text(self, text):
-        """根據配置選擇翻譯服務"""
-        provider = self.config.get('translation_service', {}).get('provider', 'google')
-        
-        if provider == 'google':
-            return self.translate_with_google(text)
-        elif provider == 'custom_llm':
-            return self.translate_with_custom_llm(text)
-        else:
-            return self.translate_with_google(text)  # 默認使用Google
+    CHUNK_MAX_TOKENS = 600      # 長文本分塊翻譯時每塊的token預算（LLM）
+    CHUNK_CONTEXT_CHARS = 200   # 每塊附帶的前文字符數（LLM參考上下文）
+    CHUNK_CONCURRENCY = 4
+    SENTENCE_CACHE_MIN_CHARS = 500  # 較短的多句文本有句子命中記憶庫時才按句翻譯
+    _chunk_executor = None
+    _chunk_executor_lock = threading.Lock()
+    detector = LanguageDetector()  # 語言檢測器無狀態，所有請求共用
+    in_flight = SingleFlight()  # 相同請求（規範化原文、語言對、提供商）同時只調用一次翻譯服務
     
-    def translate_with_google(self, text):
-        """使用Google翻譯API"""
-        try:
-            from googletrans import Translator
-            translator = Translator()
-            
-            # 獲取目標語言，並映射到Google Translate支持的代碼
-            target_lang = self.config.get('translation', {}).get('default_target', 'zh-TW')
-            
-            # 語言代碼映射
-            language_mapping = {
-                'zh-TW': 'zh-tw',  # 繁體中文
-                'zh-CN': 'zh-cn',  # 簡體中文
-                'zh': 'zh-cn',     # 默認簡體中文
-                'en': 'en',        # 英語
-                'ja': 'ja',        # 日語
-                'ko': 'ko',        # 韓語
-                'fr': 'fr',        # 法語
-                'de': 'de',        # 德語
-                'es': 'es',        # 西班牙語
-                'pt': 'pt',        # 葡萄牙語
-                'ru': 'ru',        # 俄語
-                'ar': 'ar',        # 阿拉伯語
-                'hi': 'hi',        # 印地語
-                'th': 'th',        # 泰語
-                'vi': 'vi'         # 越南語
-            }
-            
-            # 使用映射的語言代碼，如果沒有映射則使用原始代碼
-            google_lang_code = language_mapping.get(target_lang, target_lang)
-            
-            result = translator.translate(text, dest=google_lang_code)
-            return result.text
-        except ImportError:
-            # 如果googletrans未安裝，使用備用方案
-            return self.translate_with_requests(text)
-        except Exception as e:
-            raise Exception(f"Google翻譯錯誤: {str(e)}")
+    def __init__(self, config, memory=None):
+        self.config = config
+        self.memory = memory
+        self.router = TranslationRouter(config, lambda provider, texts, **options: self.translate_texts(
+            texts, provider, **options))
     
-    def translate_with_requests(self, text):
-        """使用requests直接調用Google翻譯API"""
-        api_key = self.config.get('translation_service', {}).get('google_api', {}).get('api_key', '')
-        if not api_key:
-            raise Exception("Google API密鑰未設置")
+    def new_request(self, text: str, source_lang: str = 'auto', target_lang: str = None,
+                    is_stale=None, on_partial=None) -> TranslationRequest:
+        """創建翻譯請求（目標語言默認取自配置）"""
+        target_lang = target_lang or self.config.get('translation', {}).get('default_target', 'zh-TW')
+        return TranslationRequest(text, source_lang, target_lang, is_stale, on_partial)
+    
+    def translate_request(self, request: TranslationRequest) -> Optional[str]:
+        """翻譯request.text：檢測語言、查詢記憶庫，未命中時經路由調用翻譯服務並保存結果
         
-        endpoint = self.config.get('translation_service', {}).get('google_api', {}).get('endpoint', '')
-        target_lang = self.config.get('translation', {}).get('default_target', 'zh-TW')
+        請求過期時不再調用翻譯服務並返回None；
+        返回近似匹配的譯文時request.fuzzy_match記錄匹配的原文及相似度，供界面標示為近似結果
+        """
+        print(f"[DEBUG] Translation request started for text: {request.text[:30]}...")
         
-        if target_lang == 'zh-TW':
-            target_lang = 'zh'
+        # 自動檢測語言
+        if request.source_lang == 'auto':
+            try:
+                request.source_lang = self.detector.detect_language(request.text)
+                if request.source_lang == 'auto':
+                    request.source_lang = 'en'  # 默認為英語
+            except Exception as e:
+                print(f"[WARNING] Language detection failed: {e}, using 'en'")
+                request.source_lang = 'en'
         
-        params = {
-            'key': api_key,
-            'q': text,
-            'target': target_lang,
-            'format': 'text'
-        }
+        print(f"[DEBUG] Detected language: {request.source_lang} -> {request.target_lang}")
         
-        response = requests.post(endpoint, data=params)
-        if response.status_code == 200:
-            result = response.json()
-            return result['data']['translations'][0]['translatedText']
+        provider = self.config.get('translation_service', {}).get('provider', 'google')
+        model = self.get_model_name()
+        
+        # 檢查翻譯記憶庫
+        if self.memory:
+            try:
+                start = time.monotonic()
+                cached = self.memory.get_translation(request.text, request.source_lang, request.target_lang,
+                                                     provider, model)
+                if cached:
+                    print(f"[DEBUG] Using cached translation")
+                    ProviderMetrics.get().record(provider, request.source_lang, request.target_lang,
+                                                 time.monotonic() - start, [request.text], [cached],
+                                                 cache_status='cache')
+                    return cached
+                
+                similar = self.memory.find_similar(request.text, request.source_lang, request.target_lang,
+                                                   model=model)
+                if similar:
+                    print(f"[DEBUG] Using fuzzy memory match ({similar[2]:.0%}): {similar[0][:30]}...")
+                    ProviderMetrics.get().record(provider, request.source_lang, request.target_lang,
+                                                 time.monotonic() - start, [request.text], [similar[1]],
+                                                 cache_status='fuzzy')
+                    request.fuzzy_match = (similar[0], similar[2])
+                    return similar[1]
+            except Exception as e:
+                print(f"[WARNING] Memory lookup failed: {e}")
+        
+        if request.is_stale and request.is_stale():
+            print(f"[DEBUG] Dropping stale request: {request.text[:30]}...")
+            return None
+        
+        print(f"[DEBUG] Starting translation...")
+        request.flight_key = TranslationMemory.make_key(request.text, request.source_lang, request.target_lang,
+                                                        provider, model)
+        while True:
+            try:
+                result, shared = self.in_flight.do(request.flight_key, lambda: self.translate_and_save(request))
+                break
+            except TranslationCancelled:
+                if request.is_stale and request.is_stale():
+                    print(f"[DEBUG] Cancelled stale request: {request.text[:30]}...")
+                    return None
+                # 加入的相同請求在流式輸出中途被取消，由本請求重新翻譯
+        if shared:
+            print(f"[DEBUG] Joined in-flight translation of identical text")
+        return result
+    
+    def is_cancelled(self, request: TranslationRequest) -> bool:
+        """流式輸出是否應中途停止：請求已過期，且沒有相同的請求在等待結果"""
+        return bool(request.is_stale and request.is_stale()) and not self.in_flight.waiters(request.flight_key)
+    
+    def is_streaming(self, request: Optional[TranslationRequest], provider: str = None) -> bool:
+        """是否以流式輸出請求自定義LLM（請求需要on_partial回調且未在配置中關閉stream）"""
+        service_config = self.config.get('translation_service', {})
+        return (request is not None and request.on_partial is not None
+                and (provider or service_config.get('provider', 'google')) == 'custom_llm'
+                and service_config.get('custom_llm', {}).get('stream', True))
+    
+    def translate_and_save(self, request: TranslationRequest) -> str:
+        """經路由調用翻譯服務並保存到記憶庫（按實際提供譯文的服務保存，過期的請求也保存）
+        
+        多句文本按句查詢記憶庫，較長或有句子命中時只翻譯未命中的句子，否則整段翻譯
+        （sentence_cache關閉或沒有記憶庫時同樣整段翻譯），超過分塊預算的部分按段落及句子分組並行翻譯
+        """
+        segmenter = self.get_segmenter()
+        translated = None
+        if self.memory is not None and self.config.get('translation', {}).get('sentence_cache', True):
+            segments = segmenter.segments(request.text)
+            if len(segments) > 1:
+                translated = self.translate_segments(request, segmenter, segments)
+        if translated is None:
+            chunks = segmenter.split(request.text)
+            if len(chunks) > 1:
+                translated = self.translate_chunks(request, chunks)
+        if translated is not None:
+            result, provider = translated
         else:
-            raise Exception(f"API請求失敗: {response.status_code}")
+            on_partial = (lambda parts: request.on_partial(parts[0])) if self.is_streaming(request) else None
+            translations, provider = self.router.translate([request.text], source_lang=request.source_lang,
+                                                           target_lang=request.target_lang, on_partial=on_partial,
+                                                           request=request)
+            result = translations[0]
+        print(f"[DEBUG] Translation result ({provider}): {result[:50] if result else 'None'}...")
+        
+        if self.memory and result:
+            try:
+                self.memory.save_translation(request.text, result, request.source_lang, request.target_lang,
+                                             provider, self.get_model_name(provider))
+                print(f"[DEBUG] Saved to memory")
+            except Exception as e:
+                print(f"[WARNING] Memory save failed: {e}")
+        return result
+    
+    def get_segmenter(self) -> TextSegmenter:
+        """按配置的服務選擇分塊預算：LLM按token估算，其他服務按單次請求的字符上限"""
+        provider = self.config.get('translation_service', {}).get('provider', 'google')
+        if provider == 'custom_llm':
+            return TextSegmenter(max_tokens=self.config.get('translation', {}).get(
+                'chunk_max_tokens', self.CHUNK_MAX_TOKENS))
+        provider_class = TranslationProvider.get_class(provider) or TranslationProvider
+        return TextSegmenter(max_chars=provider_class.MAX_CHARS)
+    
+    @classmethod
+    def get_chunk_executor(cls, max_workers: int) -> ThreadPoolExecutor:
+        """分塊翻譯共享的線程池（與路由的請求線程池分開，避免互相等待）"""
+        with cls._chunk_executor_lock:
+            if cls._chunk_executor is None:
+                cls._chunk_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="TranslationChunk")
+            return cls._chunk_executor
     
-    def translate_with_custom_llm(self, text):
-        """使用自定義LLM翻譯"""
-        llm_config = self.config.get('translation_service', {}).get('custom_llm', {})
+    def translate_groups(self, request: TranslationRequest, segments: List[Tuple[str, str]],
+                         translations: List[Optional[str]], groups: List[List[int]]) -> List[str]:
+        """並行翻譯各組段，譯文按序號填入translations，返回各組實際使用的提供商
+        
+        每組一次經路由的請求（可各自轉移服務），LLM請求附帶組前的上文作為參考；
+        已連續完成的開頭部分通過on_partial顯示，請求被取消時不再等待其餘的組。
+        只有一組且自定義LLM流式輸出時，組內已生成的部分譯文逐token顯示
+        """
+        translation_config = self.config.get('translation', {})
+        context_chars = translation_config.get('chunk_context_chars', self.CHUNK_CONTEXT_CHARS)
+        rate_limits = translation_config.get('rate_limits', {})
+        executor = self.get_chunk_executor(max(1, translation_config.get('chunk_concurrency', self.CHUNK_CONCURRENCY)))
+        
+        def acquire(provider):
+            RateLimiter.for_provider(provider, rate_limits.get(provider, rate_limits.get('default', 5))).acquire()
+        
+        def show_streamed(texts, parts):
+            partial = dict(zip(texts, parts))
+            current = [translation if translation is not None else partial.get(segment)
+                       for (segment, _), translation in zip(segments, translations)]
+            done = 0
+            while done < len(segments) and current[done]:
+                done += 1
+            if done:
+                request.on_partial(TextSegmenter.join(segments[:done], current[:done], request.target_lang))
+        
+        streaming = len(groups) == 1 and self.is_streaming(request)
+        
+        def translate_group(group):
+            texts = list(dict.fromkeys(segments[i][0] for i in group))  # 組內重複的句子只翻譯一次
+            context = ''
+            if group[0] and context_chars:
+                context = ''.join(segment + separator for segment, separator
+                                  in segments[max(0, group[0] - 10):group[0]]).strip()[-context_chars:]
+            on_partial = (lambda parts: show_streamed(texts, parts)) if streaming else None
+            results, provider = self.router.translate(texts, hedge=False, acquire=acquire,
+                                                      source_lang=request.source_lang,
+                                                      target_lang=request.target_lang, on_partial=on_partial,
+                                                      context=context, request=request)
+            return dict(zip(texts, results)), provider
+        
+        completed = 0
+        
+        def show_progress():
+            nonlocal completed
+            done = completed
+            while done < len(segments) and translations[done] is not None:
+                done += 1
+            if request.on_partial and completed < done < len(segments):
+                request.on_partial(TextSegmenter.join(segments[:done], translations[:done], request.target_lang))
+            completed = done
+        
+        print(f"[DEBUG] Translating {len(groups)} groups of {len(segments)} segments in parallel")
+        futures = {executor.submit(translate_group, group): n for n, group in enumerate(groups)}
+        providers = [None] * len(groups)
+        try:
+            show_progress()
+            for future in as_completed(futures):
+                n = futures[future]
+                results, providers[n] = future.result()
+                for i in groups[n]:
+                    translations[i] = results[segments[i][0]]
+                if self.is_cancelled(request):
+                    raise TranslationCancelled("翻譯請求已被新請求取代")
+                show_progress()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return providers
+    
+    def translate_chunks(self, request: TranslationRequest, chunks: List[Tuple[str, str]]) -> Tuple[str, str]:
+        """並行翻譯長文本的各塊並按原順序拼接，返回 (譯文, 翻譯最多塊的提供商)"""
+        translations = [None] * len(chunks)
+        providers = self.translate_groups(request, chunks, translations, [[i] for i in range(len(chunks))])
+        return (TextSegmenter.join(chunks, translations, request.target_lang),
+                max(set(providers), key=providers.count))
+    
+    def translate_segments(self, request: TranslationRequest, segmenter: TextSegmenter,
+                           segments: List[Tuple[str, str]]) -> Optional[Tuple[str, str]]:
+        """句子級翻譯：逐句查詢記憶庫，只翻譯未命中的句子，與命中的譯文按原順序拼接
         
-        if not llm_config.get('enabled', False):
-            raise Exception("自定義LLM未啟用")
+        新譯出的句子單獨保存到記憶庫，之後重疊的段落可以沿用；返回 (譯文, 翻譯最多句子的提供商)。
+        短於sentence_cache_min_chars且沒有句子命中時返回None，由調用方整段翻譯（保留句間上下文，少拆請求）
+        """
+        provider = self.config.get('translation_service', {}).get('provider', 'google')
+        model = self.get_model_name()
+        texts = [segment for segment, _ in segments]
         
-        api_url = llm_config.get('api_url', '')
-        api_key = llm_config.get('api_key', '')
-        system_prompt = llm_config.get('system_prompt', '')
+        start = time.monotonic()
+        try:
+            cached = self.memory.get_translations_bulk(texts, request.source_lang, request.target_lang,
+                                                       provider, model)
+        except Exception as e:
+            print(f"[WARNING] Segment lookup failed: {e}")
+            cached = {}
+        translations = [cached.get(text) for text in texts]
+        hits = [text for text in texts if text in cached]
+        self.memory.record_segment_lookup(texts, hits)
+        if hits:
+            ProviderMetrics.get().record(provider, request.source_lang, request.target_lang,
+                                         time.monotonic() - start, hits, [cached[text] for text in hits],
+                                         cache_status='cache')
+        print(f"[DEBUG] Segment cache: {len(hits)}/{len(texts)} sentences, "
+              f"{sum(map(len, hits)) / max(1, sum(map(len, texts))):.0%} of characters")
+        min_chars = self.config.get('translation', {}).get('sentence_cache_min_chars', self.SENTENCE_CACHE_MIN_CHARS)
+        if not hits and len(request.text) < min_chars:
+            return None
+        
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+        provider_class = TranslationProvider.get_class(provider) or TranslationProvider
+        groups = [[missing[j] for j in group]
+                  for group in segmenter.pack([segments[i] for i in missing], provider_class.MAX_BATCH_SIZE)]
+        providers = self.translate_groups(request, segments, translations, groups) if groups else []
+        
+        saved = set()
+        for group, used_provider in zip(groups, providers):
+            for i in group:
+                if texts[i] in saved:
+                    continue
+                saved.add(texts[i])
+                try:
+                    self.memory.save_translation(texts[i], translations[i], request.source_lang,
+                                                 request.target_lang, used_provider, self.get_model_name(used_provider))
+                except Exception as e:
+                    print(f"[WARNING] Segment memory save failed: {e}")
         
-        if not api_url:
-            raise Exception("LLM API URL未設置")
+        used = [used_provider for group, used_provider in zip(groups, providers) for _ in group] or [provider]
+        return TextSegmenter.join(segments, translations, request.target_lang), max(set(used), key=used.count)
+    
+    @staticmethod
+    def pack_segments(texts: List[str], batch_size: int, max_chars: int) -> List[List[str]]:
+        """按條數和字符數上限把文本分組，每組一次請求（超長文本單獨成組）"""
+        packs = []
+        current, current_chars = [], 0
+        for text in texts:
+            if current and (len(current) >= batch_size or current_chars + len(text) > max_chars):
+                packs.append(current)
+                current, current_chars = [], 0
+            current.append(text)
+            current_chars += len(text)
+        if current:
+            packs.append(current)
+        return packs
+    
+    def get_provider(self, provider: str, request: TranslationRequest = None, on_partial=None) -> TranslationProvider:
+        """創建服務適配器（自定義LLM流式輸出時把各條部分譯文傳給on_partial，請求過期時中途停止）"""
+        if provider == 'custom_llm':
+            streaming = self.is_streaming(request, provider)
+            return CustomLLMProvider(self.config, on_partial=on_partial if streaming else None,
+                                     is_cancelled=(lambda: self.is_cancelled(request)) if request else None)
+        return TranslationProvider.create(provider, self.config)
+    
+    def translate_texts(self, texts: List[str], provider: str = None, context: str = '',
+                        on_partial=None, request: TranslationRequest = None) -> List[str]:
+        """一次請求翻譯多個文本，返回與輸入順序對應的譯文（provider默認為配置的服務）
+        
+        context: 分塊翻譯時的前文（只供LLM參考，不翻譯）
+        on_partial: on_partial(各條已生成的譯文列表)，只有自定義LLM流式輸出時調用
+        request: 發起翻譯的請求（語言對及過期狀態），默認為自動檢測源語言、配置的目標語言
+        """
+        provider = provider or self.config.get('translation_service', {}).get('provider', 'google')
+        if provider not in PROVIDER_CLASSES:
+            provider = 'google'  # 默認使用Google
+        
+        request = request or self.new_request('')
+        adapter = self.get_provider(provider, request, on_partial)
+        if provider == 'custom_llm':
+            # 段組已按token預算打包，一次請求並附帶前文
+            return adapter.translate_chunk(texts, request.source_lang, request.target_lang, context)
+        return adapter.translate_batch(texts, request.source_lang, request.target_lang)
+    
+    def get_model_name(self, provider: str = None):
+        """提供商使用的模型（參與記憶庫鍵，換模型後不沿用舊譯文）"""
+        service_config = self.config.get('translation_service', {})
+        if (provider or service_config.get('provider')) == 'custom_llm':
+            return LLMRequestBuilder(self.config).model
+        return None
+    
+    def translate_text(self, text, provider: str = None):
+        """根據配置選擇翻譯服務"""
+        return self.translate_texts([text], provider)[0]
+
+class TranslationPipeline:
+    """翻譯流水線 - 長駐線程池處理彈窗翻譯請求，不依賴Qt事件循環
+    
+    新請求使之前的請求過期：未開始的過期請求直接跳過，進行中的請求完成後只保存到記憶庫而不再回調，
+    流式輸出中的過期請求中途停止，調用方無需等待或停止舊請求。
+    """
+    
+    def __init__(self, config: dict, memory: TranslationMemory = None, max_workers: int = 4):
+        self.config = config
+        self.memory = memory
+        self.engine = TranslationEngine(config, memory)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="TranslationPipeline")
+        self._latest = 0
+        self._lock = threading.Lock()
+    
+    def submit(self, text: str, source_lang: str, target_lang: str, on_result, on_error, on_partial=None,
+               on_match=None) -> int:
+        """提交翻譯請求，返回請求序號；on_result(序號, 譯文) / on_error(序號, 錯誤信息) /
+        on_partial(序號, 部分譯文) 只對最新請求調用；
+        結果來自近似匹配時先調用on_match(序號, 記憶庫中的原文, 相似度)"""
+        with self._lock:
+            self._latest += 1
+            request_id = self._latest
+        self._executor.submit(self._run, request_id, text, source_lang, target_lang, on_result, on_error, on_partial,
+                              on_match)
+        return request_id
+    
+    def is_current(self, request_id: int) -> bool:
+        return request_id == self._latest
+    
+    def cancel(self):
+        """使所有未完成的請求過期"""
+        with self._lock:
+            self._latest += 1
+    
+    def _run(self, request_id, text, source_lang, target_lang, on_result, on_error, on_partial=None, on_match=None):
+        if not self.is_current(request_id):
+            print(f"[DEBUG] Skipping stale request #{request_id}")
+            return
         
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        def partial(translation):
+            if self.is_current(request_id):
+                on_partial(request_id, translation)
         
-        if api_key:
-            headers['Authorization'] = f'Bearer {api_key}'
+        request = self.engine.new_request(text, source_lang, target_lang,
+                                          is_stale=lambda: not self.is_current(request_id),
+                                          on_partial=partial if on_partial else None)
+        try:
+            result = self.engine.translate_request(request)
+        except Exception as e:
+            print(f"[ERROR] 翻譯失敗: {e}")
+            if self.is_current(request_id):
+                on_error(request_id, f"翻譯失敗: {str(e)}")
+            return
         
-        # 構建請求數據（適用於OpenAI格式的API）
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"請翻譯以下文字：{text}"}
-            ],
-            "max_tokens": 1000,
-            "temperature": 0.3
-        }
+        if result is not None and self.is_current(request_id):
+            if request.fuzzy_match and on_match:
+                on_match(request_id, *request.fuzzy_match)
+            on_result(request_id, result)
+        elif result is not None:
+            print(f"[DEBUG] Dropping result of stale request #{request_id}")
+    
+    def shutdown(self):
+        """退出時使請求過期，不等待進行中的請求"""
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class TranslationService(QObject):
+    """彈窗翻譯服務 - 把TranslationPipeline的回調轉為Qt信號（在主線程中處理）"""
+    translation_complete = pyqtSignal(int, str, str, object)  # 請求序號, 原文, 譯文, 近似匹配(記憶庫原文, 相似度)或None
+    translation_partial = pyqtSignal(int, str, str)  # 請求序號, 原文, 已生成的部分譯文（流式輸出）
+    translation_error = pyqtSignal(int, str)  # 請求序號, 錯誤信息
+    
+    def __init__(self, config: dict, memory: TranslationMemory = None, parent=None):
+        super().__init__(parent)
+        self.pipeline = TranslationPipeline(config, memory)
+    
+    def translate(self, text: str, source_lang: str = 'auto', target_lang: str = None) -> int:
+        """提交翻譯請求（立即返回），之前的請求自動作廢"""
+        target_lang = target_lang or self.pipeline.config.get('translation', {}).get('default_target', 'zh-TW')
+        match = {}  # on_match與on_result在同一線程中先後調用，發出結果或錯誤時移除
+        
+        def on_result(request_id, result):
+            self.translation_complete.emit(request_id, text, result, match.pop(request_id, None))
+        
+        def on_error(request_id, error):
+            match.pop(request_id, None)
+            self.translation_error.emit(request_id, error)
+        
+        return self.pipeline.submit(
+            text, source_lang, target_lang, on_result, on_error,
+            lambda request_id, partial: self.translation_partial.emit(request_id, text, partial),
+            lambda request_id, source, score: match.update({request_id: (source, score)})
+        )
+    
+    def is_current(self, request_id: int) -> bool:
+        """信號排隊期間可能已有更新的請求，處理前再次確認"""
+        return self.pipeline.is_current(request_id)
+    
+    def cancel(self):
+        self.pipeline.cancel()
+    
+    def shutdown(self):
+        self.pipeline.shutdown()
+
+class BatchTranslationEngine:
+    """批量翻譯引擎 - 不依賴Qt事件循環，供批量翻譯線程及命令行工具共用
+    
+    先批量查詢記憶庫及近似匹配，其餘文本打包後並發調用API（按提供商限流），
+    完成的行通過on_rows回調分塊返回，新翻譯在結束時一次保存到記憶庫。
+    """
+    
+    ROW_CHUNK_SIZE = 200  # 緩存命中的行按塊返回
+    
+    def __init__(self, config: dict, memory: TranslationMemory, source_lang: str, target_lang: str,
+                 use_fuzzy: bool = True):
+        self.config = config
+        self.memory = memory
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.use_fuzzy = use_fuzzy  # 是否使用近似匹配的譯文
+        self.translator = TranslationEngine(config)
+        self.request = self.translator.new_request('', source_lang, target_lang)
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        """取消翻譯：未開始的請求不再發送，進行中的請求完成後保存"""
+        self._cancel_event.set()
+    
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+    
+    def translate(self, texts: List[str], on_rows) -> int:
+        """翻譯一批文本，on_rows([(序號, result), ...])在完成時調用，返回完成的行數"""
+        new_rows = []
+        completed = 0
+        translation_config = self.config.get('translation', {})
+        provider = self.config.get('translation_service', {}).get('provider', 'google')
+        model = self.translator.get_model_name()
         
-        response = requests.post(api_url, json=data, headers=headers)
+        def deliver(rows):
+            nonlocal completed
+            if rows:
+                completed += len(rows)
+                on_rows(rows)
         
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content'].strip()
-        else:
-            raise Exception(f"LLM API請求失敗: {response.status_code}")
+        try:
+            # 一次查詢整批文本
+            start = time.monotonic()
+            cached = self.memory.get_translations_bulk(texts, self.source_lang, self.target_lang, provider, model)
+            pending = {}  # 需要調用API的文本 -> 序號列表（批次內重複文本只翻譯一次）
+            ready = []
+            hits = {'cache': [], 'fuzzy': []}  # 記憶庫命中的行（用於記錄指標）
+            
+            for i, text in enumerate(texts):
+                row = None
+                if text in cached:
+                    row = {'original': text, 'translation': cached[text], 'source': 'cache'}
+                elif text in pending:
+                    pending[text].append(i)
+                else:
+                    similar = self.use_fuzzy and self.memory.find_similar(text, self.source_lang, self.target_lang,
+                                                                         model=model)
+                    if similar:
+                        row = {'original': text, 'translation': similar[1], 'source': 'fuzzy', 'score': similar[2]}
+                    else:
+                        pending[text] = [i]
+                
+                if row:
+                    ready.append((i, row))
+                    hits[row['source']].append(row)
+                if len(ready) >= self.ROW_CHUNK_SIZE:
+                    deliver(ready)
+                    ready = []
+            deliver(ready)
+            
+            # 記憶庫命中按批次記錄一條指標
+            for cache_status, rows in hits.items():
+                if rows:
+                    ProviderMetrics.get().record(provider, self.source_lang, self.target_lang,
+                                                 time.monotonic() - start, [row['original'] for row in rows],
+                                                 [row['translation'] for row in rows], cache_status=cache_status)
+            
+            if not pending or self._cancel_event.is_set():
+                return completed
+            
+            # 並發調用API，吞吐量只受提供商限流約束
+            rate_limits = translation_config.get('rate_limits', {})
+            limiter = RateLimiter.for_provider(provider, rate_limits.get(provider, rate_limits.get('default', 5)))
+            concurrency = max(1, translation_config.get('batch_concurrency', 4))
+            
+            # 多行打包為一次請求，按batch_size及提供商的條數、字符上限分組
+            provider_class = TranslationProvider.get_class(provider) or TranslationProvider
+            max_chars = translation_config.get('batch_max_chars', {}).get(provider, provider_class.MAX_CHARS)
+            batch_size = min(max(1, translation_config.get('batch_size', 50)), provider_class.MAX_BATCH_SIZE)
+            packs = TranslationEngine.pack_segments(list(pending), batch_size, max_chars)
+            
+            def acquire(used_provider):
+                if used_provider == provider:
+                    limiter.acquire()
+                else:
+                    RateLimiter.for_provider(used_provider, rate_limits.get(
+                        used_provider, rate_limits.get('default', 5))).acquire()
+            
+            def translate(pack):
+                if self._cancel_event.is_set():
+                    return None
+                # 批量翻譯只在出錯時轉到下一個服務，不發對沖請求
+                return self.translator.router.translate(pack, hedge=False, acquire=acquire,
+                                                        source_lang=self.source_lang, target_lang=self.target_lang,
+                                                        request=self.request)
+            
+            def collect(pack, result):
+                """記錄一次請求的譯文並返回對應的行"""
+                translations, used_provider = result
+                used_model = self.translator.get_model_name(used_provider)
+                rows = []
+                for text, translation in zip(pack, translations):
+                    new_rows.append((text, translation, self.source_lang, self.target_lang,
+                                     used_provider, used_model))
+                    rows += [(i, {'original': text, 'translation': translation, 'source': 'api'})
+                             for i in pending[text]]
+                deliver(rows)
+            
+            print(f"[DEBUG] Batch translating {len(pending)} lines in {len(packs)} requests")
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="BatchTranslation")
+            futures = {executor.submit(translate, pack): pack for pack in packs}
+            collected = set()
+            error = None
+            try:
+                for future in as_completed(futures):
+                    if self._cancel_event.is_set():
+                        break
+                    collected.add(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # 一組失敗時先保留其他已完成的組，再拋出
+                        error = e
+                        break
+                    if result is not None:
+                        collect(futures[future], result)
+            finally:
+                # 取消或出錯時不再發送未開始的請求，等待進行中的請求結束
+                executor.shutdown(wait=True, cancel_futures=True)
+            
+            # 取消或出錯時保留已經完成的請求
+            for future, pack in futures.items():
+                if (future not in collected and future.done() and not future.cancelled()
+                        and future.exception() is None and future.result() is not None):
+                    collect(pack, future.result())
+            
+            if error is not None:
+                raise error
+            return completed
+        finally:
+            # 出錯或中斷時也保留已完成的翻譯
+            self.save_new_rows(new_rows)
+    
+    def save_new_rows(self, new_rows):
+        """新翻譯在一個事務中保存到記憶庫"""
+        if not new_rows:
+            return
+        try:
+            self.memory.save_translations_bulk(new_rows)
+        except Exception as e:
+            print(f"[WARNING] Batch memory save failed: {e}")
 
 class BatchTranslationWorker(QThread):
     """批量翻譯工作線程"""
     progress_updated = pyqtSignal(int, int)  # current, total
     translation_complete = pyqtSignal(list)  # list of results
     translation_error = pyqtSignal(str)
+    rows_ready = pyqtSignal(list)  # 流式模式：[(行號, result), ...]
+    batch_finished = pyqtSignal(int, bool)  # 流式模式：完成行數, 是否已取消
     
-    def __init__(self, texts: List[str], source_lang: str, target_lang: str, config: dict, memory: TranslationMemory):
+    def __init__(self, texts: List[str], source_lang: str, target_lang: str, config: dict, memory: TranslationMemory,
+                 streaming: bool = False, row_indexes: List[int] = None):
         super().__init__()
         self.texts = texts
         self.source_lang = source_lang
         self.target_lang = target_lang
         self.config = config
         self.memory = memory
+        # 流式模式逐塊發送結果而不在結束時返回完整列表；row_indexes為各文本在表格中的行號（用於繼續翻譯）
+        self.streaming = streaming
+        self.row_indexes = row_indexes or list(range(len(texts)))
+        self.engine = BatchTranslationEngine(config, memory, source_lang, target_lang)
+    
+    def cancel(self):
+        """取消翻譯：未開始的請求不再發送，進行中的請求完成後保存"""
+        self.engine.cancel()
+    
+    def is_cancelled(self):
+        return self.engine.is_cancelled()
     
     def run(self):
         try:
-            results = []
             total = len(self.texts)
+            results = None if self.streaming else [None] * total
+            completed = 0
             
-            for i, text in enumerate(self.texts):
-                # 先檢查翻譯記憶庫
-                cached = self.memory.get_translation(text, self.source_lang, self.target_lang)
-                if cached:
-                    results.append({'original': text, 'translation': cached, 'source': 'cache'})
+            def on_rows(rows):
+                """發送或收集一組完成的行"""
+                nonlocal completed
+                completed += len(rows)
+                if self.streaming:
+                    self.rows_ready.emit([(self.row_indexes[i], result) for i, result in rows])
                 else:
-                    # 執行翻譯
-                    worker = TranslationWorker(text, self.config)
-                    translation = worker.translate_text(text)
-                    
-                    # 保存到記憶庫
-                    provider = self.config.get('translation_service', {}).get('provider', 'google')
-                    self.memory.save_translation(text, translation, self.source_lang, self.target_lang, provider)
-                    
-                    results.append({'original': text, 'translation': translation, 'source': 'api'})
-                
-                self.progress_updated.emit(i + 1, total)
-                self.msleep(100)  # 避免API限制
+                    for i, result in rows:
+                        results[i] = result
+                self.progress_updated.emit(completed, total)
+            
+            self.engine.translate(self.texts, on_rows)
             
-            self.translation_complete.emit(results)
+            if self.streaming:
+                self.batch_finished.emit(completed, self.engine.is_cancelled())
+            else:
+                self.translation_complete.emit(results)
         except Exception as e:
             self.translation_error.emit(str(e))
 
@@ -1062,11 +3962,10 @@ class LanguageManagerDialog(QDialog):
     
     def load_languages(self):
         """加載語言列表"""
-        conn = sqlite3.connect(self.memory.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT code, name, native_name, enabled FROM language_config ORDER BY name')
-        languages = cursor.fetchall()
+        with self.memory.connection() as conn:
+            languages = conn.execute(
+                'SELECT code, name, native_name, enabled FROM language_config ORDER BY name'
+            ).fetchall()
         
         self.language_table.setRowCount(len(languages))
         
@@ -1078,23 +3977,18 @@ class LanguageManagerDialog(QDialog):
             enabled_checkbox = QCheckBox()
             enabled_checkbox.setChecked(bool(enabled))
             self.language_table.setCellWidget(row, 3, enabled_checkbox)
-        
-        conn.close()
     
     def save_languages(self):
         """保存語言配置"""
-        conn = sqlite3.connect(self.memory.db_path)
-        cursor = conn.cursor()
-        
-        for row in range(self.language_table.rowCount()):
-            code = self.language_table.item(row, 0).text()
-            enabled_checkbox = self.language_table.cellWidget(row, 3)
-            enabled = enabled_checkbox.isChecked()
+        with self.memory.connection() as conn:
+            for row in range(self.language_table.rowCount()):
+                code = self.language_table.item(row, 0).text()
+                enabled_checkbox = self.language_table.cellWidget(row, 3)
+                enabled = enabled_checkbox.isChecked()
+                
+                conn.execute('UPDATE language_config SET enabled = ? WHERE code = ?', (enabled, code))
             
-            cursor.execute('UPDATE language_config SET enabled = ? WHERE code = ?', (enabled, code))
-        
-        conn.commit()
-        conn.close()
+            conn.commit()
         
         QMessageBox.information(self, "成功", "語言配置已保存！")
         self.accept()
@@ -1137,6 +4031,7 @@ class BatchTranslationDialog(QDialog):
         
         self.input_text = QTextEdit()
         self.input_text.setPlaceholderText("請輸入待翻譯的文本，每行一個條目...")
+        self.input_text.textChanged.connect(self.reset_batch)
         input_layout.addWidget(self.input_text)
         
         layout.addWidget(input_group)
@@ -1164,6 +4059,10 @@ class BatchTranslationDialog(QDialog):
         self.translate_button = QPushButton("開始翻譯")
         self.translate_button.clicked.connect(self.start_translation)
         
+        self.cancel_button = QPushButton("取消")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_translation)
+        
         export_button = QPushButton("導出結果")
         export_button.clicked.connect(self.export_results)
         
@@ -1174,15 +4073,26 @@ class BatchTranslationDialog(QDialog):
         close_button.clicked.connect(self.accept)
         
         button_layout.addWidget(self.translate_button)
+        button_layout.addWidget(self.cancel_button)
         button_layout.addWidget(export_button)
         button_layout.addWidget(clear_button)
         button_layout.addItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
         button_layout.addWidget(close_button)
         
         layout.addLayout(button_layout)
+        
+        # 當前批次狀態（取消後可繼續翻譯剩餘的行）
+        self.batch_worker = None
+        self.batch_texts = []
+        self.completed_rows = set()
     
     def start_translation(self):
-        """開始批量翻譯"""
+        """開始批量翻譯，已取消的批次則繼續翻譯剩餘的行"""
+        if self.batch_texts and len(self.completed_rows) < len(self.batch_texts):
+            remaining = [row for row in range(len(self.batch_texts)) if row not in self.completed_rows]
+            self.run_batch(remaining)
+            return
+        
         text_content = self.input_text.toPlainText().strip()
         if not text_content:
             QMessageBox.warning(self, "警告", "請輸入待翻譯的文本！")
@@ -1193,45 +4103,88 @@ class BatchTranslationDialog(QDialog):
             QMessageBox.warning(self, "警告", "沒有有效的文本行！")
             return
         
+        self.batch_texts = texts
+        self.completed_rows = set()
+        
+        # 先列出原文，譯文完成後逐行填入
+        self.result_table.setRowCount(len(texts))
+        for row, text in enumerate(texts):
+            self.result_table.setItem(row, 0, QTableWidgetItem(text))
+            self.result_table.setItem(row, 1, QTableWidgetItem(""))
+            self.result_table.setItem(row, 2, QTableWidgetItem("等待中"))
+        
+        self.progress_bar.setMaximum(len(texts))
+        self.run_batch(list(range(len(texts))))
+    
+    def run_batch(self, rows):
+        """為指定的行啟動流式批量翻譯線程"""
         source_lang = self.source_combo.currentData()
         target_lang = self.target_combo.currentData()
         
         self.translate_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
         self.progress_bar.setVisible(True)
-        self.progress_bar.setMaximum(len(texts))
-        self.progress_bar.setValue(0)
+        self.progress_bar.setValue(len(self.completed_rows))
         
         # 啟動批量翻譯線程
-        self.batch_worker = BatchTranslationWorker(texts, source_lang, target_lang, self.config, self.memory)
-        self.batch_worker.progress_updated.connect(self.update_progress)
-        self.batch_worker.translation_complete.connect(self.show_results)
+        self.batch_worker = BatchTranslationWorker([self.batch_texts[row] for row in rows], source_lang, target_lang,
+                                                   self.config, self.memory, streaming=True, row_indexes=rows)
+        self.batch_worker.rows_ready.connect(self.append_rows)
+        self.batch_worker.batch_finished.connect(self.finish_batch)
         self.batch_worker.translation_error.connect(self.show_error)
         self.batch_worker.start()
     
-    def update_progress(self, current, total):
-        """更新進度"""
-        self.progress_bar.setValue(current)
+    def cancel_translation(self):
+        """取消當前批次"""
+        if self.batch_worker:
+            self.batch_worker.cancel()
+            self.cancel_button.setEnabled(False)
     
-    def show_results(self, results):
-        """顯示翻譯結果"""
-        self.result_table.setRowCount(len(results))
-        
-        for row, result in enumerate(results):
-            self.result_table.setItem(row, 0, QTableWidgetItem(result['original']))
+    def append_rows(self, rows):
+        """填入一組完成的翻譯結果"""
+        for row, result in rows:
             self.result_table.setItem(row, 1, QTableWidgetItem(result['translation']))
             
-            source_text = "緩存" if result['source'] == 'cache' else "API"
+            if result['source'] == 'cache':
+                source_text = "緩存"
+            elif result['source'] == 'fuzzy':
+                source_text = f"近似 {result['score']:.0%}"
+            else:
+                source_text = "API"
             self.result_table.setItem(row, 2, QTableWidgetItem(source_text))
+            self.completed_rows.add(row)
         
+        self.progress_bar.setValue(len(self.completed_rows))
+    
+    def finish_batch(self, completed, cancelled):
+        """批次結束（完成或取消）"""
         self.progress_bar.setVisible(False)
+        self.cancel_button.setEnabled(False)
         self.translate_button.setEnabled(True)
         
-        QMessageBox.information(self, "完成", f"成功翻譯 {len(results)} 個條目！")
+        remaining = len(self.batch_texts) - len(self.completed_rows)
+        if cancelled and remaining:
+            self.translate_button.setText("繼續翻譯")
+            QMessageBox.information(self, "已取消", f"已翻譯 {len(self.completed_rows)} 個條目，剩餘 {remaining} 個可繼續翻譯。")
+        else:
+            self.translate_button.setText("開始翻譯")
+            QMessageBox.information(self, "完成", f"成功翻譯 {len(self.completed_rows)} 個條目！")
+    
+    def reset_batch(self):
+        """輸入改變後不再繼續舊批次"""
+        if self.batch_worker and self.batch_worker.isRunning():
+            return
+        self.batch_texts = []
+        self.completed_rows = set()
+        self.translate_button.setText("開始翻譯")
     
     def show_error(self, error):
         """顯示錯誤"""
         self.progress_bar.setVisible(False)
+        self.cancel_button.setEnabled(False)
         self.translate_button.setEnabled(True)
+        if len(self.completed_rows) < len(self.batch_texts):
+            self.translate_button.setText("繼續翻譯")
         QMessageBox.critical(self, "錯誤", f"翻譯失敗：{error}")
     
     def export_results(self):
@@ -1243,6 +4196,9 @@ class BatchTranslationDialog(QDialog):
         # 簡單的文本導出
         results = []
         for row in range(self.result_table.rowCount()):
+            # 跳過尚未完成的行
+            if row not in self.completed_rows:
+                continue
             original = self.result_table.item(row, 0).text()
             translation = self.result_table.item(row, 1).text()
             results.append(f"{original}\t{translation}")
@@ -1255,6 +4211,7 @@ class BatchTranslationDialog(QDialog):
         """清空所有內容"""
         self.input_text.clear()
         self.result_table.setRowCount(0)
+        self.reset_batch()
 
 class TranslationHistoryDialog(QDialog):
     """翻譯歷史對話框"""
@@ -1275,9 +4232,13 @@ class TranslationHistoryDialog(QDialog):
         
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("輸入關鍵詞搜索...")
-        self.search_input.textChanged.connect(self.search_translations)
+        self.search_input.textChanged.connect(self.schedule_search)
         search_layout.addWidget(self.search_input)
         
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.search_translations)
+        
         layout.addLayout(search_layout)
         
         # 歷史表格
@@ -1313,60 +4274,53 @@ class TranslationHistoryDialog(QDialog):
     
     def load_history(self):
         """加載翻譯歷史"""
-        conn = sqlite3.connect(self.memory.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT source_text, target_text, source_lang, target_lang, provider, used_count 
-            FROM translations 
-            ORDER BY used_count DESC, created_at DESC 
-            LIMIT 1000
-        ''')
-        
-        translations = cursor.fetchall()
-        
-        self.history_table.setRowCount(len(translations))
-        
-        for row, (source, target, src_lang, tgt_lang, provider, count) in enumerate(translations):
-            self.history_table.setItem(row, 0, QTableWidgetItem(source[:100] + "..." if len(source) > 100 else source))
-            self.history_table.setItem(row, 1, QTableWidgetItem(target[:100] + "..." if len(target) > 100 else target))
-            self.history_table.setItem(row, 2, QTableWidgetItem(src_lang))
-            self.history_table.setItem(row, 3, QTableWidgetItem(tgt_lang))
-            self.history_table.setItem(row, 4, QTableWidgetItem(provider))
-            self.history_table.setItem(row, 5, QTableWidgetItem(str(count)))
-        
-        conn.close()
+        self.populate_table(self.memory.get_history(1000))
     
-    def search_translations(self, text):
+    def schedule_search(self):
+        """延遲搜索，避免每次按鍵都查詢"""
+        self.search_timer.start(200)
+    
+    def search_translations(self, text=None):
         """搜索翻譯"""
-        if not text:
+        if text is None:
+            text = self.search_input.text()
+        
+        if not text.strip():
             self.load_history()
             return
         
-        conn = sqlite3.connect(self.memory.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT source_text, target_text, source_lang, target_lang, provider, used_count 
-            FROM translations 
-            WHERE source_text LIKE ? OR target_text LIKE ?
-            ORDER BY used_count DESC, created_at DESC 
-            LIMIT 500
-        ''', (f'%{text}%', f'%{text}%'))
-        
-        translations = cursor.fetchall()
-        
+        self.populate_table(self.memory.search_history(text, 500))
+    
+    def populate_table(self, translations):
+        """填充歷史表格，搜索結果的匹配片段以高亮顯示"""
         self.history_table.setRowCount(len(translations))
         
-        for row, (source, target, src_lang, tgt_lang, provider, count) in enumerate(translations):
+        for row, record in enumerate(translations):
+            source, target, src_lang, tgt_lang, provider, count = record[:6]
             self.history_table.setItem(row, 0, QTableWidgetItem(source[:100] + "..." if len(source) > 100 else source))
             self.history_table.setItem(row, 1, QTableWidgetItem(target[:100] + "..." if len(target) > 100 else target))
             self.history_table.setItem(row, 2, QTableWidgetItem(src_lang))
             self.history_table.setItem(row, 3, QTableWidgetItem(tgt_lang))
             self.history_table.setItem(row, 4, QTableWidgetItem(provider))
             self.history_table.setItem(row, 5, QTableWidgetItem(str(count)))
-        
-        conn.close()
+            
+            # 搜索結果附帶片段，用富文本標籤顯示高亮
+            for column, snippet in ((0, record[6] if len(record) > 6 else None),
+                                    (1, record[7] if len(record) > 7 else None)):
+                if snippet and TranslationMemory.HIGHLIGHT_START in snippet:
+                    self.history_table.setCellWidget(row, column, self.create_snippet_label(snippet))
+                else:
+                    self.history_table.removeCellWidget(row, column)
+    
+    def create_snippet_label(self, snippet):
+        """將帶標記的片段轉換為高亮富文本標籤"""
+        html_text = (html.escape(snippet)
+                     .replace(TranslationMemory.HIGHLIGHT_START, '<span style="background-color: #ffeb3b;">')
+                     .replace(TranslationMemory.HIGHLIGHT_END, '</span>'))
+        label = QLabel(html_text)
+        label.setTextFormat(Qt.RichText)
+        label.setStyleSheet("padding: 0 3px;")
+        return label
     
     def clear_history(self):
         """清空翻譯歷史"""
@@ -1374,11 +4328,7 @@ class TranslationHistoryDialog(QDialog):
                                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            conn = sqlite3.connect(self.memory.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM translations')
-            conn.commit()
-            conn.close()
+            self.memory.clear_translations()
             
             self.load_history()
             QMessageBox.information(self, "成功", "翻譯歷史已清空！")
@@ -1524,6 +4474,13 @@ class SettingsDialog(QDialog):
         self.system_prompt.setPlainText(default_prompt)
         layout.addRow("系統提示詞:", self.system_prompt)
         
+        # 流式輸出
+        self.llm_stream = QCheckBox("流式顯示譯文（邊生成邊顯示）")
+        self.llm_stream.setChecked(
+            self.config.get('translation_service', {}).get('custom_llm', {}).get('stream', True)
+        )
+        layout.addRow("", self.llm_stream)
+        
         # 說明文字
         info_label = QLabel("提示：自定義LLM應該支援OpenAI相容的API格式")
         info_label.setStyleSheet("color: #666; font-size: 12px;")
@@ -1585,6 +4542,7 @@ class SettingsDialog(QDialog):
             self.config['translation_service']['custom_llm']['api_url'] = self.llm_url.text()
             self.config['translation_service']['custom_llm']['api_key'] = self.llm_api_key.text()
             self.config['translation_service']['custom_llm']['system_prompt'] = self.system_prompt.toPlainText()
+            self.config['translation_service']['custom_llm']['stream'] = self.llm_stream.isChecked()
             
             # 更新目標語言
             lang_values = ['zh-TW', 'zh-CN', 'en', 'ja', 'ko', 'fr', 'de', 'es']
@@ -1781,8 +4739,11 @@ class TranslatorWindow(QWidget):
             }
         """)
         
-    def show_translation(self, text, translation):
-        """顯示翻譯結果 - 安全版本避免視窗錯誤"""
+    def show_translation(self, text, translation, match=None):
+        """顯示翻譯結果 - 安全版本避免視窗錯誤
+        
+        match: 譯文來自近似匹配時為 (記憶庫中的原文, 相似度)，結果標示為近似並顯示匹配的原文
+        """
         print(f"[DEBUG] *** SHOW_TRANSLATION CALLED *** Text: {text[:30] if text else 'None'}... Translation: {translation[:50] if translation else 'None'}...")
         
         try:
@@ -1800,7 +4761,11 @@ class TranslatorWindow(QWidget):
                 self.initUI()
             
             # 設置翻譯結果 - 簡化版本
-            display_text = f"原文: {text}\n\n翻譯: {translation}\n\n✅ 已複製到剪貼簿"
+            if match:
+                display_text = (f"原文: {text}\n\n翻譯（近似 {match[1]:.0%}）: {translation}\n\n"
+                                f"記憶庫原文: {match[0]}\n\n✅ 已複製到剪貼簿")
+            else:
+                display_text = f"原文: {text}\n\n翻譯: {translation}\n\n✅ 已複製到剪貼簿"
             self.result_label.setText(display_text)
             
             # 簡單樣式
@@ -1858,6 +4823,11 @@ class TranslatorWindow(QWidget):
             import traceback
             traceback.print_exc()
     
+    def show_partial_translation(self, text, partial):
+        """流式輸出時更新已生成的譯文（完成後由show_translation顯示最終結果並複製）"""
+        self.result_label.setText(f"原文: {text}\n\n翻譯: {partial} ▌")
+        self.adjustSize()
+    
     def isValid(self):
         """檢查視窗控制代碼是否有效"""
         try:
@@ -1951,14 +4921,17 @@ class TranslatorWindow(QWidget):
 class TranslatorApp(QObject):
     # 添加信號用於線程安全的通信
     text_copied = pyqtSignal(str)
+    memory_cleaned = pyqtSignal(dict)  # 記憶庫後台清理完成
     
-    def __init__(self):
+    def __init__(self, memory_path: str = "translation_memory.db", metrics_path: str = None,
+                 status_path: str = "service_status.json"):
+        """memory_path / metrics_path / status_path: 記憶庫、請求指標及熔斷器狀態文件的路徑
+        （metrics_path默認取自配置；測試時可指向臨時目錄）"""
         super().__init__()
-        self.app = QApplication(sys.argv)
+        self.app = QApplication.instance() or QApplication(sys.argv)
         # 設置應用程序不要在最後一個窗口關閉時退出（系統托盤應用）
         self.app.setQuitOnLastWindowClosed(False)
         self.translator_window = TranslatorWindow()
-        self.translation_memory = TranslationMemory()  # 初始化翻譯記憶庫
         
         # QTranslate-inspired advanced features
         self.theme_manager = ThemeManager()
@@ -1991,15 +4964,39 @@ class TranslatorApp(QObject):
         
         self.load_config()
         
+        # 初始化翻譯記憶庫（前置緩存及延遲寫入設定取自配置）
+        self.translation_memory = TranslationMemory.from_config(self.config, memory_path,
+                                                                on_cleanup=self.memory_cleaned.emit)
+        # 退出時提交待寫入數據並關閉連接池
+        self.app.aboutToQuit.connect(self.translation_memory.close)
+        self.app.aboutToQuit.connect(HttpSessionManager.close_all)
+        
+        # 記錄各服務的請求指標（延遲、流量、錯誤率）
+        ProviderMetrics.configure(self.config, metrics_path)
+        self.app.aboutToQuit.connect(lambda: ProviderMetrics.get().close())
+        
+        # 熔斷器狀態寫入文件，供monitor_status.py查看
+        CircuitBreaker.status_path = status_path
+        for provider in TranslationRouter(self.config, None).provider_chain():
+            CircuitBreaker.for_provider(provider, self.config)
+        CircuitBreaker.write_status()
+        
         # Apply current theme
         self.apply_theme()
         
         self.setup_tray()
         self.setup_hotkeys()
-        self.translation_worker = None
+        
+        # 長駐的翻譯服務：新的複製事件使舊請求作廢，不阻塞界面線程
+        self.translation_service = TranslationService(self.config, self.translation_memory, self)
+        self.translation_service.translation_complete.connect(self.on_translation_complete)
+        self.translation_service.translation_partial.connect(self.on_translation_partial)
+        self.translation_service.translation_error.connect(self.on_translation_error)
+        self.app.aboutToQuit.connect(self.translation_service.shutdown)
         
         # 連接信號到槽
         self.text_copied.connect(self.handle_copied_text)
+        self.memory_cleaned.connect(self.show_memory_cleanup)
         
     def load_config(self):
         """載入配置文件"""
@@ -2058,6 +5055,12 @@ class TranslatorApp(QObject):
         language_action.triggered.connect(self.show_language_manager)
         tray_menu.addAction(language_action)
         
+        # 添加翻譯服務狀態子菜單（打開時刷新熔斷器狀態）
+        self.service_status_menu = tray_menu.addMenu("服務狀態")
+        self.service_status_menu.setToolTipsVisible(True)
+        self.service_status_menu.aboutToShow.connect(self.refresh_service_status_menu)
+        self.refresh_service_status_menu()
+        
         # 添加分隔線
         tray_menu.addSeparator()
         
@@ -2101,6 +5104,37 @@ class TranslatorApp(QObject):
                 2000
             )
     
+    def refresh_service_status_menu(self):
+        """按熔斷器狀態更新服務狀態子菜單"""
+        menu = self.service_status_menu
+        menu.clear()
+        statuses = CircuitBreaker.snapshot()
+        labels = {
+            CircuitBreaker.CLOSED: "✓ {provider}: 正常",
+            CircuitBreaker.HALF_OPEN: "… {provider}: 正在探測恢復",
+            CircuitBreaker.OPEN: "✗ {provider}: 暫停使用（{retry_in:.0f}秒後重試）",
+        }
+        for provider, status in statuses.items():
+            action = menu.addAction(labels[status['state']].format(provider=provider, retry_in=status['retry_in'] or 0))
+            action.setEnabled(False)
+            if status['last_error'] and status['state'] != CircuitBreaker.CLOSED:
+                action.setToolTip(status['last_error'])
+        if not statuses:
+            menu.addAction("暫無服務狀態").setEnabled(False)
+        
+        menu.addSeparator()
+        reset_action = menu.addAction("重置所有服務")
+        reset_action.triggered.connect(CircuitBreaker.reset_all)
+    
+    def show_memory_cleanup(self, report):
+        """通知翻譯記憶庫清理結果"""
+        self.tray_icon.showMessage(
+            "LLM翻譯器", 
+            f"翻譯記憶庫已清理 {report['removed']} 條較少使用的記錄，保留 {report['remaining']} 條", 
+            QSystemTrayIcon.Information, 
+            3000
+        )
+    
     def toggle_auto_translate(self):
         """切換自動翻譯狀態"""
         current_state = self.config.get('translation', {}).get('auto_translate', True)
@@ -2328,7 +5362,7 @@ class TranslatorApp(QObject):
                 
                 # Apply same filters as auto_translate_selection
                 if (len(text) >= 2 and  
-                    len(text) <= 500 and  
+                    len(text) <= self.config.get('translation', {}).get('max_text_length', 50000) and  
                     not text.isdigit() and  
                     not self.is_url(text) and  
                     not self.is_single_word_english(text)):
@@ -2386,7 +5420,7 @@ class TranslatorApp(QObject):
                 
                 # 過濾條件
                 if (len(text) >= 2 and  # 至少2個字符
-                    len(text) <= 500 and  # 不超過500字符
+                    len(text) <= self.config.get('translation', {}).get('max_text_length', 50000) and  # 長文本分塊翻譯
                     not text.isdigit() and  # 不是純數字
                     not self.is_url(text) and  # 不是URL
                     not self.is_single_word_english(text)):  # 不是單個英文單詞
@@ -2450,29 +5484,11 @@ class TranslatorApp(QObject):
             
             print("[SUCCESS] Translation window shown")  # 調試信息
             
-            # 停止之前的翻譯工作（如果有的話）
-            if self.translation_worker and self.translation_worker.isRunning():
-                self.translation_worker.quit()
-                self.translation_worker.wait()
-            
-            # 啟動翻譯工作線程（集成翻譯記憶庫）
-            self.translation_worker = TranslationWorker(
-                text, self.config, self.translation_memory, 'auto', 
-                self.config.get('translation', {}).get('default_target', 'zh-TW')
+            # 提交到翻譯服務（集成翻譯記憶庫），之前未完成的請求自動作廢，無需等待
+            request_id = self.translation_service.translate(
+                text, 'auto', self.config.get('translation', {}).get('default_target', 'zh-TW')
             )
-            
-            # Store text for signal handler
-            self.current_translation_text = text
-            
-            # 連接信號 - 使用直接方法確保信號正常工作
-            self.translation_worker.translation_complete.connect(self.on_translation_complete)
-            self.translation_worker.translation_error.connect(self.on_translation_error)
-            
-            print(f"[DEBUG] Signal connections established")
-            
-            print("[INFO] Starting translation worker...")  # 調試信息
-            
-            self.translation_worker.start()
+            print(f"[INFO] Translation request #{request_id} submitted")  # 調試信息
             
         except Exception as e:
             print(f"[ERROR] Error starting translation: {e}")
@@ -2485,8 +5501,8 @@ class TranslatorApp(QObject):
             except:
                 print("[ERROR] Failed to show error window")
     
-    def handle_translation_result(self, original_text, translation):
-        """處理翻譯結果並顯示到UI"""
+    def handle_translation_result(self, original_text, translation, match=None):
+        """處理翻譯結果並顯示到UI（match為近似匹配的 (記憶庫原文, 相似度)）"""
         print(f"[DEBUG] *** SIGNAL RECEIVED *** handle_translation_result called!")
         print(f"[DEBUG] Original text: {original_text[:30] if original_text else 'None'}...")
         print(f"[DEBUG] Translation: {translation[:50] if translation else 'None'}...")
@@ -2494,7 +5510,7 @@ class TranslatorApp(QObject):
         try:
             if translation and translation.strip():
                 print(f"[DEBUG] Calling show_translation with valid result...")
-                self.translator_window.show_translation(original_text, translation)
+                self.translator_window.show_translation(original_text, translation, match)
                 print(f"[SUCCESS] Translation displayed: {translation[:50]}...")
             else:
                 print("[ERROR] Empty translation result")
@@ -2506,20 +5522,33 @@ class TranslatorApp(QObject):
             traceback.print_exc()
             self.translator_window.show_error(f"顯示翻譯結果時出錯: {str(e)}")
     
-    def on_translation_complete(self, result):
-        """處理翻譯完成信號"""
+    def on_translation_complete(self, request_id, original_text, result, match=None):
+        """處理翻譯完成信號（忽略已被新請求取代的結果）"""
         print(f"[DEBUG] *** TRANSLATION COMPLETE SIGNAL *** Result: {result[:50] if result else 'None'}...")
+        if not self.translation_service.is_current(request_id):
+            print(f"[DEBUG] Ignoring stale result #{request_id}")
+            return
         try:
-            original_text = getattr(self, 'current_translation_text', 'Unknown')
-            self.handle_translation_result(original_text, result)
+            self.handle_translation_result(original_text, result, match)
         except Exception as e:
             print(f"[ERROR] Error in on_translation_complete: {e}")
             import traceback
             traceback.print_exc()
     
-    def on_translation_error(self, error):
-        """處理翻譯錯誤信號"""
+    def on_translation_partial(self, request_id, original_text, partial):
+        """流式輸出時逐步顯示已生成的譯文"""
+        if not self.translation_service.is_current(request_id):
+            return
+        try:
+            self.translator_window.show_partial_translation(original_text, partial)
+        except Exception as e:
+            print(f"[ERROR] Error in on_translation_partial: {e}")
+    
+    def on_translation_error(self, request_id, error):
+        """處理翻譯錯誤信號（忽略已被新請求取代的錯誤）"""
         print(f"[DEBUG] *** TRANSLATION ERROR SIGNAL *** Error: {error}")
+        if not self.translation_service.is_current(request_id):
+            return
         try:
             self.translator_window.show_error(str(error))
         except Exception as e: